@@ -0,0 +1,373 @@
+"""Command latency benchmarks against a local, seeded Postgres.
+
+Drives the real slash command callbacks from bot.py with the fake
+interaction objects in fakes.py and reports, per command, p50/p99 latency,
+queries issued and connections opened. Results are written as JSON so runs
+can be compared:
+
+    BENCH_DATABASE_URL=postgresql://localhost/cfi_bench python bench.py
+    python bench.py --sizes 60 --output bench_results/after.json --compare bench_results/before.json
+
+The benchmark DROPS AND RECREATES the bot's tables in BENCH_DATABASE_URL, so
+never point it at a database you care about.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import discord
+import psycopg2
+
+from fakes import FakeGuild, FakeInteraction, FakeMember
+
+# (players, matches) per league size, from today's league up to a very large one
+LEAGUE_SIZES = {
+    60: 2_000,
+    1_000: 100_000,
+    10_000: 1_000_000,
+}
+DEFAULT_ITERATIONS = 30
+SLOW_ITERATIONS = 5  # for commands that touch the whole league
+REGRESSION_THRESHOLD = 0.20
+
+# Tables holding league data. cache_version and bot_state are kept so the
+# cache version stays monotonic for the running listener.
+BOT_TABLES = ["players", "matches", "ranking_snapshots", "guild_config", "applied_writes", "audit_log"]
+BENCH_GUILD_ID = 1  # the seeded league's server
+
+
+def configure_database():
+    url = os.environ.get("BENCH_DATABASE_URL")
+    if not url:
+        sys.exit("Set BENCH_DATABASE_URL to a throwaway Postgres database.")
+    if url == os.environ.get("DATABASE_URL"):
+        sys.exit("BENCH_DATABASE_URL must not be the bot's DATABASE_URL.")
+    # bot.py reads these on every connect
+    os.environ["DATABASE_URL"] = url
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+    # Keep the bench's writes out of the live bot's write journal
+    os.environ["JOURNAL_PATH"] = ":memory:"
+    return url
+
+
+# ─────────────────────────────────────────
+# INSTRUMENTATION
+# ─────────────────────────────────────────
+class Counters:
+    def __init__(self):
+        self.queries = 0
+        self.connections = 0
+
+    def reset(self):
+        self.queries = 0
+        self.connections = 0
+
+
+counters = Counters()
+_counting_cursors = {}
+
+
+def counting_cursor(base):
+    """Subclass a cursor class so every execute() is counted."""
+    if base not in _counting_cursors:
+        class CountingCursor(base):
+            def execute(self, query, vars=None):
+                counters.queries += 1
+                return super().execute(query, vars)
+        _counting_cursors[base] = CountingCursor
+    return _counting_cursors[base]
+
+
+def instrument(bot):
+    real_connect = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        counters.connections += 1
+        if kwargs.get("cursor_factory") is not None:
+            kwargs["cursor_factory"] = counting_cursor(kwargs["cursor_factory"])
+        return real_connect(*args, **kwargs)
+
+    bot.psycopg2.connect = connect
+
+
+# ─────────────────────────────────────────
+# LEAGUE SETUP
+# ─────────────────────────────────────────
+def reset_schema(bot):
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    c = conn.cursor()
+    c.execute("DROP TABLE IF EXISTS " + ", ".join(BOT_TABLES) + " CASCADE")
+    conn.commit()
+    conn.close()
+    bot.setup_db()
+
+
+def seed_league(bot, players: int, matches: int):
+    """Fill the tiers round-robin with `players` players and `matches` random matches."""
+    reset_schema(bot)
+    conn = bot.get_db()
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO players (guild_id, name, tier, wins, losses, goals, goals_against, rank_in_tier, licensed, playstyle, pending)
+        SELECT %(guild)s, (100000 + i)::text,
+               (%(tiers)s)[1 + (i - 1) %% array_length(%(tiers)s, 1)],
+               (random() * 20)::int, (random() * 20)::int, (random() * 60)::int, (random() * 60)::int,
+               1 + (i - 1) / array_length(%(tiers)s, 1),
+               CASE WHEN i %% 3 = 0 THEN 'Yes' ELSE 'No' END,
+               (%(styles)s)[1 + i %% array_length(%(styles)s, 1)],
+               0
+        FROM generate_series(1, %(n)s) AS i
+    """, {"guild": BENCH_GUILD_ID, "tiers": bot.TIERS, "styles": bot.PLAYSTYLES, "n": players})
+    c.execute("""
+        INSERT INTO matches (guild_id, player1, player2, score1, score2, date)
+        SELECT %(guild)s, (100001 + (random() * (%(n)s - 1))::int)::text,
+               (100001 + (random() * (%(n)s - 1))::int)::text,
+               (random() * 5)::int, 6, now()::text
+        FROM generate_series(1, %(m)s)
+    """, {"guild": BENCH_GUILD_ID, "n": players, "m": matches})
+    bot.commit_change(conn, c, ["*"])
+    c.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def tier_members(bot, tier):
+    conn = bot.get_db()
+    c = conn.cursor()
+    c.execute("SELECT name FROM players WHERE guild_id = %s AND tier = %s ORDER BY rank_in_tier", (BENCH_GUILD_ID, tier))
+    names = [name for (name,) in c.fetchall()]
+    conn.close()
+    return names
+
+
+def move_to_bottom(bot, name):
+    """Put a player back at the bottom of the last tier (undoes removeandfill)."""
+    conn = bot.get_db()
+    c = conn.cursor()
+    c.execute(
+        "SELECT COALESCE(MAX(rank_in_tier), 0) + 1 AS r FROM players WHERE guild_id = %s AND tier = %s",
+        (BENCH_GUILD_ID, bot.TIERS[-1])
+    )
+    rank = c.fetchone()[0]
+    c.execute(
+        "INSERT INTO players (guild_id, name, tier, rank_in_tier, pending) VALUES (%s, %s, %s, %s, 0)",
+        (BENCH_GUILD_ID, name, bot.TIERS[-1], rank)
+    )
+    bot.commit_change(conn, c, [bot.TIERS[-1]])
+    conn.close()
+
+
+# ─────────────────────────────────────────
+# SCENARIOS
+# ─────────────────────────────────────────
+def build_scenarios(bot, guild, admin, players: int):
+    tier = bot.TIERS[len(bot.TIERS) // 2]
+    a, _, b = tier_members(bot, tier)[:3]
+    slow = SLOW_ITERATIONS if players > 60 else DEFAULT_ITERATIONS
+
+    async def invoke(name, **options):
+        command = bot.tree.get_command(name)
+        interaction = FakeInteraction(guild, admin, command=command)
+        await bot.tree.interaction_check(interaction)
+        await command.callback(interaction, **options)
+        return interaction
+
+    async def autocomplete(name, option, current, **options):
+        command = bot.tree.get_command(name)
+        interaction = FakeInteraction(guild, admin, command=command, options=options,
+                                      type=discord.InteractionType.autocomplete)
+        await bot.tree.interaction_check(interaction)
+        return await command._params[option].autocomplete(interaction, current)
+
+    async def score():
+        await invoke("score", player1=a, goals1=3, player2=b, goals2=1)
+
+    async def unscore():
+        await invoke("unscore", player1=a, player2=b)
+
+    async def updateall():
+        started = time.perf_counter()
+        await invoke("updateall")
+        elapsed = time.perf_counter() - started
+        # Let the analytics it starts finish before the next iteration; its
+        # queries are counted, its time is not
+        while bot._analytics_running:
+            await asyncio.sleep(0.001)
+        return elapsed
+
+    async def removeandfill():
+        victim = tier_members(bot, bot.TIERS[0])[0]
+        started = time.perf_counter()
+        await invoke("removeandfill", player=victim)
+        elapsed = time.perf_counter() - started
+        move_to_bottom(bot, victim)
+        return elapsed
+
+    # name -> (iterations, coroutine factory). Pairs like score/unscore leave
+    # the league as they found it so every iteration measures the same state.
+    return {
+        "tier": (DEFAULT_ITERATIONS, lambda: invoke("tier", tier=tier)),
+        "bracket": (DEFAULT_ITERATIONS, lambda: invoke("bracket", tier=tier)),
+        "profile": (DEFAULT_ITERATIONS, lambda: invoke("profile", player=a)),
+        "autocomplete": (DEFAULT_ITERATIONS, lambda: autocomplete("score", "player2", "player1", player1=a)),
+        "alltiers": (slow, lambda: invoke("alltiers")),
+        "overview": (slow, lambda: invoke("overview")),
+        "stats": (DEFAULT_ITERATIONS, lambda: invoke("stats")),
+        "score": (DEFAULT_ITERATIONS, score),
+        "unscore": (DEFAULT_ITERATIONS, unscore),
+        "setstats": (DEFAULT_ITERATIONS, lambda: invoke("setstats", player=a, goals=10)),
+        "updatetier": (DEFAULT_ITERATIONS, lambda: invoke("updatetier", tier=tier)),
+        "updateall": (slow, updateall),
+        "removeandfill": (slow, removeandfill),
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_size(bot, players: int, matches: int):
+    print(f"Seeding {players} players / {matches} matches…", flush=True)
+    seed_league(bot, players, matches)
+    guild = FakeGuild(BENCH_GUILD_ID, members=[FakeMember(100000 + i) for i in range(1, players + 1)])
+    admin = guild.add_member(FakeMember(1, "bench-admin", roles=bot.ADMIN_ROLES[:1]))
+
+    results = {}
+    scenarios = build_scenarios(bot, guild, admin, players)
+    # updateall goes first so /overview has a ranking to show, and score and
+    # unscore must alternate, so those are run interleaved at the end
+    order = ["updateall"] + [name for name in scenarios if name not in ("updateall", "score", "unscore")]
+    paired = [("score", "unscore")]
+
+    async def measure(name, factory, samples):
+        counters.reset()
+        started = time.perf_counter()
+        elapsed = await factory()
+        samples["latency"].append(elapsed if isinstance(elapsed, float) else time.perf_counter() - started)
+        samples["queries"].append(counters.queries)
+        samples["connections"].append(counters.connections)
+
+    for name in order:
+        iterations, factory = scenarios[name]
+        samples = {"latency": [], "queries": [], "connections": []}
+        for _ in range(iterations):
+            await measure(name, factory, samples)
+        results[name] = summarize(samples)
+        print_result(name, results[name])
+
+    for first, second in paired:
+        samples = {first: {"latency": [], "queries": [], "connections": []},
+                   second: {"latency": [], "queries": [], "connections": []}}
+        iterations = scenarios[first][0]
+        for _ in range(iterations):
+            await measure(first, scenarios[first][1], samples[first])
+            await measure(second, scenarios[second][1], samples[second])
+        for name in (first, second):
+            results[name] = summarize(samples[name])
+            print_result(name, results[name])
+    return results
+
+
+def print_result(name, result):
+    print(f"  {name:<14} p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+          f"queries {result['queries']:>6.1f}  connections {result['connections']:>5.1f}", flush=True)
+
+
+def summarize(samples):
+    latency = samples["latency"]
+    return {
+        "iterations": len(latency),
+        "p50_ms": round(percentile(latency, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latency, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latency) / len(latency) * 1000, 3),
+        "queries": sum(samples["queries"]) / len(latency),
+        "connections": sum(samples["connections"]) / len(latency),
+    }
+
+
+# ─────────────────────────────────────────
+# BASELINES
+# ─────────────────────────────────────────
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """Print per-command deltas against a baseline file. Returns True if nothing regressed."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    ok = True
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('revision')}):")
+    for size, commands in current["results"].items():
+        before_size = baseline["results"].get(size)
+        if not before_size:
+            continue
+        print(f"  {size} players")
+        for name, now in commands.items():
+            before = before_size.get(name)
+            if not before:
+                continue
+            delta = (now["p50_ms"] - before["p50_ms"]) / before["p50_ms"] if before["p50_ms"] else 0.0
+            flag = ""
+            if delta > threshold or now["queries"] > before["queries"]:
+                flag = "  ⚠️ regression"
+                ok = False
+            print(f"    {name:<14} p50 {before['p50_ms']:>8.2f} → {now['p50_ms']:>8.2f} ms ({delta:+.0%})  "
+                  f"queries {before['queries']:.1f} → {now['queries']:.1f}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(str(s) for s in LEAGUE_SIZES),
+                        help="comma separated player counts to benchmark (default: all)")
+    parser.add_argument("--output", default=f"bench_results/{datetime.now():%Y%m%d-%H%M%S}.json")
+    parser.add_argument("--compare", help="baseline JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--no-cache", action="store_true", help="run without the LISTEN/NOTIFY tier cache")
+    args = parser.parse_args()
+
+    configure_database()
+    import bot
+    instrument(bot)
+    bot.setup_db()
+    # Seeding and cache bookkeeping outside interactions act on the bench guild
+    bot._current_guild.set(BENCH_GUILD_ID)
+    if not args.no_cache:
+        bot.start_cache_listener()
+        while not bot._cache_listening:
+            time.sleep(0.05)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "cache": not args.no_cache,
+        },
+        "results": {},
+    }
+    for size in [int(s) for s in args.sizes.split(",")]:
+        matches = LEAGUE_SIZES.get(size, size * 100)
+        report["results"][str(size)] = asyncio.run(run_size(bot, size, matches))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {args.output}")
+
+    if args.compare and not compare(report, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,54 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import os
+import sys
+import json
+import hashlib
+import select
+import sqlite3
+import time
+import threading
+import contextvars
+import asyncio
+import heapq
+from collections import deque, Counter
 from datetime import datetime
+import aiohttp
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+import psycopg2.extensions
 
 # ─────────────────────────────────────────
 # SETTINGS
 # ─────────────────────────────────────────
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
-ADMIN_ROLES = ["Admin", "CFI - Dev"]
+ADMIN_ROLES = ["Admin", "CFI - Dev"]  # default for servers that haven't run /config
 ANNOUNCEMENT_CHANNEL_ID = 0
+LEGACY_GUILD_ID = int(os.environ.get("LEGACY_GUILD_ID", 0))  # server that owns data from before multi-guild support
+CACHE_CHANNEL = "cfi_players"      # Postgres NOTIFY channel for cache invalidation
+CACHE_RESYNC_SECONDS = 60          # how often the listener double-checks the cache version
+READ_YOUR_WRITES_SECONDS = 30      # after writing, a user's reads stay on the primary this long
+DEV_GUILD_ID = int(os.environ.get("DEV_GUILD_ID", 0))  # sync commands to this guild only (instant, for testing)
+PROFILE_DIR = "profiles"           # where /profiler writes flamegraph files
+DB_CONNECT_TIMEOUT = 5             # seconds, upper bound for opening a connection
+DB_STATEMENT_TIMEOUT_MS = 30000    # statement/lock timeout for queries outside an interaction
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))  # idle connections kept per database
+RESPONSE_MARGIN = 0.5              # seconds kept free to actually send the reply
+SLOW_QUERY_MS = int(os.environ.get("SLOW_QUERY_MS", 500))
+SLOW_QUERY_LOG = "slow_queries.log"
+PROFILE_SAMPLE_INTERVAL = 0.005    # seconds between stack samples while profiling
+ANNOUNCE_MERGE_SECONDS = 2.0       # announcements queued within this window go out as one message
+CHANNEL_RATE_LIMIT = (5, 5.0)      # at most 5 messages per 5 seconds per channel
+JOURNAL_PATH = os.environ.get("JOURNAL_PATH", "write_journal.sqlite3")  # local queue for writes during DB outages
+JOURNAL_AFTER_MS = 2000            # a journaled command's write slower than this is queued instead
+JOURNAL_RETRY_SECONDS = 5          # pause between drain attempts while the database is down
+WRITE_KEY_DAYS = 7                 # how long applied idempotency keys are remembered
+RANK_HISTORY_LIMIT = 20            # snapshots shown by /rankhistory
+AUDIT_LOG_LIMIT = 15               # actions listed by /auditlog
+AUTOCOMPLETE_LIMIT = 25            # most choices Discord accepts in one autocomplete reply
 # ─────────────────────────────────────────
 
+# Default tier ladder, highest first. Each server can set its own with /config.
 TIERS = [
     "Cosmic", "Universal", "Galaxy",
     "Global", "International",
@@ -23,17 +59,329 @@ TIERS = [
     "Bronze"
 ]
 
+# Commands that never write. Their queries may be served by DATABASE_REPLICA_URL.
+READ_ONLY_COMMANDS = {"tier", "bracket", "profile", "alltiers", "overview", "rankhistory", "rankdiff", "auditlog", "stats"}
+
+# Admin commands that overwrite or delete league data. Every row they change
+# is written to audit_log with its before and after image (see setup_db).
+AUDITED_COMMANDS = {"setstats", "removeplayer", "removeandfill", "unscore", "updatetier", "updateall", "auditrevert"}
+
+# Commands that write straight to the database instead of through the write
+# journal. They are refused while their guild has journaled writes waiting,
+# so they can't overtake them (score, unscore and setstats queue up instead).
+DIRECT_WRITE_COMMANDS = {"addplayer", "removeplayer", "updatetier", "updateall", "removeandfill", "config", "auditrevert"}
+
+# Per-interaction state, set in CFITree.interaction_check
+_current_user = contextvars.ContextVar("current_user", default=None)
+_read_only_command = contextvars.ContextVar("read_only_command", default=False)
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+_current_interaction = contextvars.ContextVar("current_interaction", default=None)
+_current_guild = contextvars.ContextVar("current_guild", default=None)
+_statement_cap_ms = contextvars.ContextVar("statement_cap_ms", default=None)
+_audit_context = contextvars.ContextVar("audit_context", default=None)  # "action:actor:command"
+
+def current_guild():
+    """Guild id of the interaction being handled; every league query is scoped to it."""
+    return _current_guild.get()
+
+class CFITree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.guild_id is None:
+            # Leagues belong to a server; there is nothing to show in DMs
+            if interaction.type == discord.InteractionType.application_command:
+                await interaction.response.send_message("❌ This bot only works inside a server!", ephemeral=True)
+            return False
+        _current_guild.set(interaction.guild_id)
+        _current_user.set(interaction.user.id)
+        _current_interaction.set(interaction)
+        command = interaction.command
+        _read_only_command.set(command is not None and command.name in READ_ONLY_COMMANDS)
+        audited = command is not None and command.name in AUDITED_COMMANDS
+        _audit_context.set(f"{interaction.id}:{interaction.user.id}:{command.name}" if audited else None)
+        if interaction.type == discord.InteractionType.application_command and command.name in DIRECT_WRITE_COMMANDS:
+            waiting = journal_pending(interaction.guild_id)
+            if waiting:
+                await interaction.response.send_message(
+                    f"⏳ {waiting} earlier change(s) are still being applied. Please try again in a moment!",
+                    ephemeral=True
+                )
+                return False
+        start_trace(interaction)
+        start_profile(interaction)
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        finish_trace(interaction, ok=False)
+        await finish_profile(interaction)
+        original = getattr(error, "original", error)
+        if isinstance(original, DB_BUSY_ERRORS):
+            print(f"⏳ /{interaction.command.name if interaction.command else '?'} ran out of time: {original}")
+            msg = "⏳ The database is busy right now. Please try again in a moment!"
+            try:
+                if interaction.response.is_done():
+                    await interaction.followup.send(msg, ephemeral=True)
+                else:
+                    await interaction.response.send_message(msg, ephemeral=True)
+            except discord.HTTPException:
+                pass
+            return
+        await super().on_error(interaction, error)
+
+# Times Discord REST calls for /profiler
+http_trace = aiohttp.TraceConfig()
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = commands.AutoShardedBot(command_prefix="!", intents=intents, tree_cls=CFITree, http_trace=http_trace)
 tree = bot.tree
 
 # ─────────────────────────────────────────
 # DATABASE
 # ─────────────────────────────────────────
-def get_db():
-    conn = psycopg2.connect(os.environ.get("DATABASE_URL"), cursor_factory=RealDictCursor)
+class DeadlineExceeded(Exception):
+    """The interaction ran out of time before the query could run."""
+
+# Errors that mean "the database didn't answer in time", answered with a
+# friendly retry message instead of a stack trace
+DB_BUSY_ERRORS = (
+    DeadlineExceeded,
+    psycopg2.errors.QueryCanceled,
+    psycopg2.errors.LockNotAvailable,
+    psycopg2.OperationalError,
+)
+
+def time_left():
+    """Seconds the current interaction may still spend on the database, or None outside one.
+
+    Discord wants an acknowledgement within 3 seconds and follow-ups within
+    15 minutes; a little margin is kept to send the reply itself."""
+    interaction = _current_interaction.get()
+    if interaction is None:
+        return None
+    limit = 900 if interaction.response.is_done() else 3
+    elapsed = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    return limit - RESPONSE_MARGIN - elapsed
+
+def query_timeout_ms() -> int:
+    limit = min(DB_STATEMENT_TIMEOUT_MS, _statement_cap_ms.get() or DB_STATEMENT_TIMEOUT_MS)
+    remaining = time_left()
+    if remaining is None:
+        return limit
+    if remaining <= 0.001:
+        raise DeadlineExceeded("interaction deadline passed")
+    return min(limit, int(remaining * 1000))
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that bounds every query by the interaction's deadline.
+
+    Each statement is sent with SET LOCAL statement/lock timeouts in the same
+    round trip, plus the audit context while an audited command runs. Slow
+    statements are logged with their parameters and plan, and query time is
+    reported to an active /profiler session."""
+    def execute(self, query, vars=None):
+        timeout = query_timeout_ms()
+        bounded = f"SET LOCAL statement_timeout = {timeout}; SET LOCAL lock_timeout = {timeout}; {query}"
+        audit = _audit_context.get()
+        if audit:
+            bounded = f"SET LOCAL cfi.audit = '{audit}'; {bounded}"
+        session = _current_profile.get()
+        started = time.perf_counter()
+        error = None
+        try:
+            return super().execute(bounded, vars)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if session is not None:
+                session.db_calls += 1
+                session.db_time += elapsed
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                log_slow_query(self.connection, query, vars, elapsed, error)
+
+def explain(conn, query, vars):
+    """EXPLAIN a statement on the connection that ran it, without disturbing its transaction."""
+    if not query.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "EXECUTE")):
+        return None
+    c = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    savepoint = not conn.autocommit
+    try:
+        if savepoint:
+            c.execute("SAVEPOINT slow_query_explain")
+        c.execute("EXPLAIN " + query, vars)
+        plan = "\n".join(row[0] for row in c.fetchall())
+        if savepoint:
+            c.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    except Exception as e:
+        if savepoint:
+            c.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+        return f"EXPLAIN failed: {e}"
+
+def named_statement(query):
+    """(name, EXECUTE part) of a call made by run(), which may be prefixed
+    with the statement's PREPARE; None for any other query."""
+    call = query.rsplit("; ", 1)[-1] if query.startswith("PREPARE ") else query
+    parts = call.split(None, 2)
+    if len(parts) < 2 or parts[0] != "EXECUTE" or parts[1] not in QUERIES:
+        return None
+    return parts[1], call
+
+def log_slow_query(conn, query, vars, elapsed, error=None):
+    interaction = _current_interaction.get()
+    entry = {
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "ms": round(elapsed * 1000, 1),
+        "command": interaction.command.name if interaction is not None and interaction.command else None,
+        "query": " ".join(query.split()),
+        "params": [str(v) for v in vars] if isinstance(vars, (list, tuple)) else vars,
+    }
+    named = named_statement(query)
+    if named is not None:
+        # Log the statement's SQL rather than "EXECUTE name", and EXPLAIN the
+        # EXECUTE alone: the session holds the prepared statement by now, so
+        # this plans it with the bound parameters
+        entry["statement"] = named[0]
+        entry["query"] = " ".join(QUERIES[named[0]].split())
+        query = named[1]
+    if error is not None:
+        # The transaction is aborted, so there is nothing to EXPLAIN with
+        entry["error"] = str(error).strip()
+    else:
+        try:
+            entry["plan"] = explain(conn, query, vars)
+        except Exception as e:
+            entry["plan"] = f"EXPLAIN failed: {e}"
+    print(f"🐢 Slow query ({entry['ms']} ms) in /{entry['command']}: {entry['query'][:120]}")
+    try:
+        with open(SLOW_QUERY_LOG, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+    except OSError as e:
+        print(f"Slow query log write failed: {e}")
+
+_recent_writers = {}  # user id -> time.monotonic() until which their reads go to the primary
+
+def note_write():
+    """Pin the current user's reads to the primary for a short while after a write."""
+    user = _current_user.get()
+    if user is None:
+        return
+    now = time.monotonic()
+    for uid in [u for u, until in _recent_writers.items() if until <= now]:
+        del _recent_writers[uid]
+    _recent_writers[user] = now + READ_YOUR_WRITES_SECONDS
+
+def use_replica():
+    if not os.environ.get("DATABASE_REPLICA_URL") or not _read_only_command.get():
+        return False
+    until = _recent_writers.get(_current_user.get())
+    # Read-your-writes: whoever just wrote keeps reading from the primary
+    return until is None or until <= time.monotonic()
+
+class BotConnection(psycopg2.extensions.connection):
+    """Connection that goes back to its pool on close() and remembers which
+    QUERIES it has prepared."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.pool_key = None      # DSN of the pool this connection belongs to, if any
+        self.checked_out = False
+        self.reusable = True
+
+    def close(self):
+        if self.pool_key is not None and self.closed and self.checked_out:
+            # Broken while in use: the server probably restarted, so its
+            # siblings in the pool are dead too
+            drop_idle_connections(self.pool_key)
+        if self.pool_key is None or self.closed:
+            return super().close()
+        if not self.checked_out:
+            return
+        self.checked_out = False
+        try:
+            if self.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                self.rollback()
+            self.autocommit = False
+        except psycopg2.Error:
+            self.reusable = False
+        if not (self.reusable and release_connection(self)):
+            super().close()
+
+_pools = {}  # dsn -> idle BotConnections
+_pool_lock = threading.Lock()
+
+def connection_alive(conn):
+    """Whether an idle connection can still be used, without a round trip.
+
+    An idle connection has nothing to read unless the server hung up on it
+    (restart, idle timeout), which leaves an error message or EOF behind."""
+    if conn.closed:
+        return False
+    try:
+        readable, _, _ = select.select([conn], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+def checkout_connection(dsn):
+    dead = []
+    conn = None
+    with _pool_lock:
+        idle = _pools.get(dsn)
+        while idle:
+            candidate = idle.pop()
+            if connection_alive(candidate):
+                conn = candidate
+                break
+            dead.append(candidate)
+    for candidate in dead:
+        psycopg2.extensions.connection.close(candidate)
+    return conn
+
+def drop_idle_connections(dsn):
+    with _pool_lock:
+        idle = _pools.pop(dsn, [])
+    for conn in idle:
+        psycopg2.extensions.connection.close(conn)
+
+def release_connection(conn):
+    with _pool_lock:
+        idle = _pools.setdefault(conn.pool_key, [])
+        if len(idle) >= DB_POOL_SIZE:
+            return False
+        idle.append(conn)
+        return True
+
+def get_db(primary=False):
+    """Get a pooled database connection; close() hands it back.
+
+    Read-only commands go to DATABASE_REPLICA_URL when it is set, unless
+    primary=True or the user wrote something in the last few seconds."""
+    dsn = os.environ.get("DATABASE_URL")
+    if not primary and use_replica():
+        dsn = os.environ.get("DATABASE_REPLICA_URL")
+    remaining = time_left()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("interaction deadline passed")
+    # libpq counts connect_timeout in whole seconds and treats anything below 2 as 2
+    connect_timeout = DB_CONNECT_TIMEOUT if remaining is None else max(2, min(DB_CONNECT_TIMEOUT, int(remaining)))
+    cap = _statement_cap_ms.get()
+    if cap is not None:
+        # e.g. journaled writes, which should fall back to the journal quickly
+        connect_timeout = min(connect_timeout, max(2, cap // 1000))
+    conn = checkout_connection(dsn)
+    if conn is None:
+        session = _current_profile.get()
+        started = time.perf_counter()
+        conn = psycopg2.connect(dsn, connection_factory=BotConnection, cursor_factory=TimedCursor,
+                                connect_timeout=connect_timeout)
+        conn.pool_key = dsn
+        if session is not None:
+            session.db_connects += 1
+            session.db_time += time.perf_counter() - started
+    conn.checked_out = True
     return conn
 
 def setup_db():
@@ -41,7 +389,8 @@ def setup_db():
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS players (
-            name TEXT PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
+            name TEXT NOT NULL,
             tier TEXT NOT NULL,
             wins INTEGER DEFAULT 0,
             losses INTEGER DEFAULT 0,
@@ -52,19 +401,26 @@ def setup_db():
             round_losses INTEGER DEFAULT 0,
             round_done INTEGER DEFAULT 0,
             licensed TEXT DEFAULT 'No',
-            playstyle TEXT DEFAULT 'Balanced'
+            playstyle TEXT DEFAULT 'Balanced',
+            PRIMARY KEY (guild_id, name)
         )
     """)
+    # One row per /updateall: the league order as parallel arrays of player
+    # ids and their tiers, position = array index
     c.execute("""
-        CREATE TABLE IF NOT EXISTS overview_ranking (
-            position INTEGER PRIMARY KEY,
-            player_id TEXT NOT NULL,
-            tier TEXT NOT NULL
+        CREATE TABLE IF NOT EXISTS ranking_snapshots (
+            guild_id BIGINT NOT NULL,
+            version INTEGER NOT NULL,
+            taken_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            players TEXT[] NOT NULL,
+            tiers TEXT[] NOT NULL,
+            PRIMARY KEY (guild_id, version)
         )
     """)
     c.execute("""
         CREATE TABLE IF NOT EXISTS matches (
             id SERIAL PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
             player1 TEXT,
             player2 TEXT,
             score1 INTEGER,
@@ -72,16 +428,52 @@ def setup_db():
             date TEXT
         )
     """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id BIGINT PRIMARY KEY,
+            tiers TEXT[] NOT NULL,
+            admin_roles TEXT[] NOT NULL,
+            announcement_channel_id BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS cache_version (
+            id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            version BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("INSERT INTO cache_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    # Idempotency keys of writes that went through, so a journaled write is
+    # never applied twice (see WRITE JOURNAL)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS applied_writes (
+            key TEXT PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    c.execute("DELETE FROM applied_writes WHERE applied_at < now() - make_interval(days => %s)", (WRITE_KEY_DAYS,))
+    conn.commit()
+
     # Clean up all name formats to raw numeric ID
     try:
         c.execute("SELECT name FROM players")
         all_names = c.fetchall()
-        for row in all_names:
-            raw = row["name"]
+        renamed = False
+        for (raw,) in all_names:
             clean = raw.strip("<@>").strip()
             if clean != raw:
                 c.execute("UPDATE players SET name = %s WHERE name = %s", (clean, raw))
-        conn.commit()
+                renamed = True
+        if renamed:
+            commit_change(conn, c, ["*"])
+        else:
+            conn.commit()
     except Exception as e:
         print(f"Migration cleanup error: {e}")
         conn.rollback()
@@ -104,71 +496,823 @@ def setup_db():
         conn.commit()
     except Exception:
         conn.rollback()
+
+    # overview_ranking held only the latest ranking; it is replaced by ranking_snapshots
+    c.execute("SELECT to_regclass('overview_ranking') IS NOT NULL")
+    has_overview = c.fetchone()[0]
+    league_tables = ("players", "matches") + (("overview_ranking",) if has_overview else ())
+
+    # Tables from before multi-guild support have no guild_id. Their rows are
+    # parked under guild 0 until LEGACY_GUILD_ID says which server owns them.
+    c.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'players' AND column_name = 'guild_id'
+    """)
+    if c.fetchone() is None:
+        for table in league_tables:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN guild_id BIGINT NOT NULL DEFAULT 0")
+            c.execute(f"ALTER TABLE {table} ALTER COLUMN guild_id DROP DEFAULT")
+        c.execute("ALTER TABLE players DROP CONSTRAINT players_pkey, ADD PRIMARY KEY (guild_id, name)")
+        if has_overview:
+            c.execute("ALTER TABLE overview_ranking DROP CONSTRAINT overview_ranking_pkey, ADD PRIMARY KEY (guild_id, position)")
+        commit_change(conn, c, ["*"])
+        print("📦 Migrated league tables to per-guild storage")
+    if LEGACY_GUILD_ID:
+        claimed = 0
+        for table in league_tables + ("ranking_snapshots",):
+            c.execute(f"UPDATE {table} SET guild_id = %s WHERE guild_id = 0", (LEGACY_GUILD_ID,))
+            claimed += c.rowcount
+        if claimed:
+            commit_change(conn, c, ["*"])
+            print(f"📦 Moved {claimed} rows from the single-league setup to guild {LEGACY_GUILD_ID}")
+        else:
+            conn.commit()
+    else:
+        c.execute("SELECT 1 FROM players WHERE guild_id = 0 LIMIT 1")
+        if c.fetchone() is not None:
+            print("⚠️ League data from the single-league setup is unassigned. Set LEGACY_GUILD_ID to its server's id.")
+        conn.commit()
+
+    if has_overview:
+        c.execute("""
+            INSERT INTO ranking_snapshots (guild_id, version, players, tiers)
+            SELECT guild_id, 1, array_agg(player_id ORDER BY position), array_agg(tier ORDER BY position)
+            FROM overview_ranking GROUP BY guild_id
+            ON CONFLICT DO NOTHING
+        """)
+        c.execute("DROP TABLE overview_ranking")
+        commit_change(conn, c, ["*"])
+        print("📦 Moved the last overview into ranking_snapshots")
+
+    # Snapshots hold ids as get_uid() returns them, like overview_ranking did;
+    # early snapshots copied names stored in mention form as they were
+    c.execute("""
+        UPDATE ranking_snapshots
+        SET players = ARRAY(SELECT btrim(n, '<@> ') FROM unnest(players) WITH ORDINALITY AS u(n, i) ORDER BY i)
+        WHERE EXISTS (SELECT 1 FROM unnest(players) AS n WHERE n <> btrim(n, '<@> '))
+    """)
+    conn.commit()
+
+    c.execute("CREATE INDEX IF NOT EXISTS players_guild_tier ON players (guild_id, tier, rank_in_tier)")
+    # Lets /rankhistory find the snapshots a player appears in (players @> ARRAY[id])
+    c.execute("CREATE INDEX IF NOT EXISTS ranking_snapshots_players ON ranking_snapshots USING GIN (players)")
+    c.execute("CREATE INDEX IF NOT EXISTS matches_guild_players ON matches (guild_id, player1, player2)")
+    conn.commit()
+
+    # /score runs as a single function call: validate, insert the match,
+    # update both players, bump the cache version, notify, and hand back the
+    # new standings, all in one round trip.
+    c.execute("DROP FUNCTION IF EXISTS cfi_score(TEXT, TEXT, INTEGER, INTEGER, TEXT)")
+    c.execute("DROP FUNCTION IF EXISTS cfi_score(BIGINT, TEXT, TEXT, INTEGER, INTEGER, TEXT)")
+    c.execute("""
+        CREATE OR REPLACE FUNCTION cfi_score(guild BIGINT, name1 TEXT, name2 TEXT, goals1 INTEGER, goals2 INTEGER,
+                                             played TEXT, write_key TEXT)
+        RETURNS JSON AS $$
+        DECLARE
+            p1 players%%ROWTYPE;
+            p2 players%%ROWTYPE;
+            w players%%ROWTYPE;
+            l players%%ROWTYPE;
+            winner_name TEXT := CASE WHEN goals1 > goals2 THEN name1 ELSE name2 END;
+            loser_name TEXT := CASE WHEN goals1 > goals2 THEN name2 ELSE name1 END;
+            new_version BIGINT;
+        BEGIN
+            INSERT INTO applied_writes (key) VALUES (write_key) ON CONFLICT DO NOTHING;
+            IF NOT FOUND THEN
+                RETURN json_build_object('status', 'duplicate');
+            END IF;
+            -- Lock both players in a fixed order so concurrent scores can't deadlock
+            PERFORM 1 FROM players WHERE guild_id = guild AND name IN (name1, name2) ORDER BY name FOR UPDATE;
+            SELECT * INTO p1 FROM players WHERE guild_id = guild AND name = name1;
+            IF NOT FOUND THEN
+                RETURN json_build_object('status', 'missing', 'player', 1);
+            END IF;
+            SELECT * INTO p2 FROM players WHERE guild_id = guild AND name = name2;
+            IF NOT FOUND THEN
+                RETURN json_build_object('status', 'missing', 'player', 2);
+            END IF;
+            IF (p1.round_wins, p1.round_losses) <> (p2.round_wins, p2.round_losses) THEN
+                RETURN json_build_object('status', 'record', 'p1', row_to_json(p1), 'p2', row_to_json(p2));
+            END IF;
+            IF p1.round_done <> 0 OR p2.round_done <> 0 THEN
+                RETURN json_build_object('status', 'done');
+            END IF;
+
+            INSERT INTO matches (guild_id, player1, player2, score1, score2, date)
+            VALUES (guild, name1, name2, goals1, goals2, played);
+            UPDATE players SET wins = wins + 1, goals = goals + GREATEST(goals1, goals2),
+                goals_against = goals_against + LEAST(goals1, goals2), round_wins = round_wins + 1,
+                round_done = CASE WHEN round_wins + 1 >= 2 THEN 1 ELSE round_done END
+            WHERE guild_id = guild AND name = winner_name RETURNING * INTO w;
+            UPDATE players SET losses = losses + 1, goals = goals + LEAST(goals1, goals2),
+                goals_against = goals_against + GREATEST(goals1, goals2), round_losses = round_losses + 1,
+                round_done = CASE WHEN round_losses + 1 >= 2 THEN 1 ELSE round_done END
+            WHERE guild_id = guild AND name = loser_name RETURNING * INTO l;
+
+            UPDATE cache_version SET version = version + 1 WHERE id = 1 RETURNING version INTO new_version;
+            PERFORM pg_notify(%s, json_build_object(
+                'v', new_version, 'g', guild, 't', ARRAY(SELECT DISTINCT t FROM unnest(ARRAY[w.tier, l.tier]) AS t ORDER BY t)
+            )::text);
+
+            RETURN json_build_object(
+                'status', 'ok',
+                'version', new_version,
+                'tier', p1.tier,
+                'winner', row_to_json(w),
+                'loser', row_to_json(l),
+                'standings', (
+                    SELECT COALESCE(json_agg(row_to_json(p) ORDER BY p.rank_in_tier), '[]'::json)
+                    FROM players p WHERE p.guild_id = guild AND p.tier = p1.tier AND (p.pending IS NULL OR p.pending = 0)
+                )
+            );
+        END;
+        $$ LANGUAGE plpgsql
+    """, (CACHE_CHANNEL,))
+    conn.commit()
+
+    # Audit trail. Statement-level triggers see every row a statement changed
+    # through its transition tables and log them all with one INSERT ... SELECT
+    # in the same transaction, so auditing adds no round trips. They only log
+    # while cfi.audit is set, which TimedCursor does for AUDITED_COMMANDS.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id BIGSERIAL PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
+            action BIGINT NOT NULL,
+            actor BIGINT NOT NULL,
+            command TEXT NOT NULL,
+            at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            before JSONB,
+            after JSONB
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS audit_log_guild_action ON audit_log (guild_id, action)")
+    c.execute("CREATE INDEX IF NOT EXISTS audit_log_guild_row ON audit_log (guild_id, row_key)")
+    c.execute("""
+        CREATE OR REPLACE FUNCTION cfi_audit() RETURNS trigger AS $$
+        DECLARE
+            ctx TEXT := current_setting('cfi.audit', true);
+            key TEXT := TG_ARGV[0];
+        BEGIN
+            IF COALESCE(ctx, '') = '' THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO audit_log (guild_id, action, actor, command, table_name, row_key, before, after)
+                SELECT n.guild_id, split_part(ctx, ':', 1)::bigint, split_part(ctx, ':', 2)::bigint,
+                       split_part(ctx, ':', 3), TG_TABLE_NAME, to_jsonb(n) ->> key, NULL, to_jsonb(n)
+                FROM new_rows n;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO audit_log (guild_id, action, actor, command, table_name, row_key, before, after)
+                SELECT o.guild_id, split_part(ctx, ':', 1)::bigint, split_part(ctx, ':', 2)::bigint,
+                       split_part(ctx, ':', 3), TG_TABLE_NAME, to_jsonb(o) ->> key, to_jsonb(o), NULL
+                FROM old_rows o;
+            ELSE
+                INSERT INTO audit_log (guild_id, action, actor, command, table_name, row_key, before, after)
+                WITH o AS MATERIALIZED (SELECT guild_id, to_jsonb(r) AS image FROM old_rows r),
+                     n AS MATERIALIZED (SELECT guild_id, to_jsonb(r) AS image FROM new_rows r)
+                SELECT o.guild_id, split_part(ctx, ':', 1)::bigint, split_part(ctx, ':', 2)::bigint,
+                       split_part(ctx, ':', 3), TG_TABLE_NAME, o.image ->> key, o.image, n.image
+                FROM o JOIN n ON n.guild_id = o.guild_id AND n.image ->> key = o.image ->> key
+                WHERE o.image <> n.image;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    c.execute("SELECT tgname FROM pg_trigger WHERE tgname LIKE '%\\_audit\\_%'")
+    existing = {name for (name,) in c.fetchall()}
+    for table, key in (("players", "name"), ("matches", "id")):
+        for event, transition in (("INSERT", "NEW TABLE AS new_rows"),
+                                  ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                                  ("DELETE", "OLD TABLE AS old_rows")):
+            trigger = f"{table}_audit_{event.lower()}"
+            if trigger not in existing:
+                c.execute(f"""
+                    CREATE TRIGGER {trigger} AFTER {event} ON {table}
+                    REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION cfi_audit('{key}')
+                """)
+
+    # Undo one audited action (named by any of its audit_log ids) by putting
+    # back the before images, newest first. Refused if a row changed since.
+    c.execute("""
+        CREATE OR REPLACE FUNCTION cfi_revert(guild BIGINT, entry BIGINT) RETURNS JSON AS $$
+        DECLARE
+            target BIGINT;
+            e audit_log%ROWTYPE;
+            key_column TEXT;
+            columns TEXT;
+            current_image JSONB;
+            later BIGINT;
+            touched TEXT[] := '{}';
+            reverted INTEGER := 0;
+        BEGIN
+            SELECT action INTO target FROM audit_log WHERE guild_id = guild AND id = entry;
+            IF NOT FOUND THEN
+                RETURN json_build_object('status', 'missing');
+            END IF;
+            -- Every row must still look like the action left it
+            FOR e IN
+                SELECT DISTINCT ON (table_name, row_key) * FROM audit_log
+                WHERE guild_id = guild AND action = target ORDER BY table_name, row_key, id DESC
+            LOOP
+                key_column := CASE e.table_name WHEN 'players' THEN 'name' ELSE 'id' END;
+                EXECUTE format('SELECT to_jsonb(t) FROM %I t WHERE guild_id = $1 AND %I::text = $2 FOR UPDATE',
+                               e.table_name, key_column)
+                    INTO current_image USING guild, e.row_key;
+                IF current_image IS DISTINCT FROM e.after THEN
+                    -- Entry number of the newest audited action that touched the row since, if any
+                    SELECT MIN(id) INTO later FROM audit_log WHERE guild_id = guild AND action = (
+                        SELECT action FROM audit_log
+                        WHERE guild_id = guild AND table_name = e.table_name AND row_key = e.row_key
+                          AND id > e.id AND action <> target
+                        ORDER BY id DESC LIMIT 1
+                    );
+                    RETURN json_build_object('status', 'conflict', 'table', e.table_name, 'row', e.row_key,
+                                             'later', later, 'expected', e.after, 'current', current_image);
+                END IF;
+            END LOOP;
+            FOR e IN SELECT * FROM audit_log WHERE guild_id = guild AND action = target ORDER BY id DESC LOOP
+                key_column := CASE e.table_name WHEN 'players' THEN 'name' ELSE 'id' END;
+                IF e.before IS NULL THEN
+                    EXECUTE format('DELETE FROM %I WHERE guild_id = $1 AND %I::text = $2', e.table_name, key_column)
+                        USING guild, e.row_key;
+                ELSIF e.after IS NULL THEN
+                    EXECUTE format('INSERT INTO %I SELECT * FROM jsonb_populate_record(NULL::%I, $1)',
+                                   e.table_name, e.table_name)
+                        USING e.before;
+                ELSE
+                    SELECT string_agg(quote_ident(attname), ', ') INTO columns FROM pg_attribute
+                    WHERE attrelid = e.table_name::regclass AND attnum > 0 AND NOT attisdropped;
+                    EXECUTE format('UPDATE %I SET (%s) = (SELECT %s FROM jsonb_populate_record(NULL::%I, $1)) '
+                                   'WHERE guild_id = $2 AND %I::text = $3',
+                                   e.table_name, columns, columns, e.table_name, key_column)
+                        USING e.before, guild, e.row_key;
+                END IF;
+                IF e.table_name = 'players' THEN
+                    touched := touched || ARRAY[e.before ->> 'tier', e.after ->> 'tier'];
+                END IF;
+                reverted := reverted + 1;
+            END LOOP;
+            RETURN json_build_object(
+                'status', 'ok', 'action', target, 'rows', reverted,
+                'tiers', ARRAY(SELECT DISTINCT t FROM unnest(touched) AS t WHERE t IS NOT NULL)
+            );
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    conn.commit()
     conn.close()
 
+# ─────────────────────────────────────────
+# ROW MODEL
+# ─────────────────────────────────────────
+# Rows come back from the database as plain tuples and are wrapped in these
+# slotted classes, in column order, instead of a dict per row. Whole-league
+# commands hold every player at once, so a row should stay small; figures
+# derived from it (matches played, winrate) are computed when asked for.
+class Player:
+    """A row of players."""
+    __slots__ = ("guild_id", "name", "tier", "wins", "losses", "goals", "goals_against", "rank_in_tier",
+                 "round_wins", "round_losses", "round_done", "licensed", "playstyle", "pending")
+
+    def __init__(self, guild_id, name, tier, wins, losses, goals, goals_against, rank_in_tier,
+                 round_wins, round_losses, round_done, licensed, playstyle, pending):
+        self.guild_id = guild_id
+        self.name = name
+        self.tier = tier
+        self.wins = wins
+        self.losses = losses
+        self.goals = goals
+        self.goals_against = goals_against
+        self.rank_in_tier = rank_in_tier
+        self.round_wins = round_wins
+        self.round_losses = round_losses
+        self.round_done = round_done
+        self.licensed = licensed
+        self.playstyle = playstyle
+        self.pending = pending
+
+    @classmethod
+    def from_json(cls, row: dict):
+        """Build from a row_to_json() object, as returned by cfi_score()."""
+        return cls(*(row[column] for column in cls.__slots__))
+
+    @property
+    def total(self) -> int:
+        """Matches played."""
+        return self.wins + self.losses
+
+    @property
+    def winrate(self) -> float:
+        """Share of matches won, between 0 and 1."""
+        total = self.wins + self.losses
+        return self.wins / total if total > 0 else 0
+
+    @property
+    def round_record(self):
+        return (self.round_wins, self.round_losses)
+
+    def __repr__(self):
+        return f"<Player {self.name} {self.tier} #{self.rank_in_tier}>"
+
+class Match:
+    """A row of matches."""
+    __slots__ = ("id", "guild_id", "player1", "player2", "score1", "score2", "date")
+
+    def __init__(self, id, guild_id, player1, player2, score1, score2, date):
+        self.id = id
+        self.guild_id = guild_id
+        self.player1 = player1
+        self.player2 = player2
+        self.score1 = score1
+        self.score2 = score2
+        self.date = date
+
+    def __repr__(self):
+        return f"<Match {self.id}: {self.player1} {self.score1} - {self.score2} {self.player2}>"
+
+class Snapshot:
+    """A row of ranking_snapshots: the league order saved by one /updateall."""
+    __slots__ = ("version", "taken_at", "players", "tiers")
+
+    def __init__(self, version, taken_at, players, tiers):
+        self.version = version
+        self.taken_at = taken_at
+        self.players = players
+        self.tiers = tiers
+
+    def positions(self) -> dict:
+        """Player id -> (position counting from 1, tier)."""
+        return {name: (i, tier) for i, (name, tier) in enumerate(zip(self.players, self.tiers), 1)}
+
+    def __repr__(self):
+        return f"<Snapshot {self.version}: {len(self.players)} players>"
+
+# ─────────────────────────────────────────
+# QUERIES
+# ─────────────────────────────────────────
+# Every statement the bot runs outside of setup_db, by name. run() prepares
+# each one server-side the first time a pooled connection uses it and
+# EXECUTEs it from then on, so hot statements are parsed and planned once per
+# connection. Explicit column lists keep prepared plans valid when columns
+# are added. League statements take the guild id as $1.
+PLAYER_COLUMNS = ", ".join(Player.__slots__)
+MATCH_COLUMNS = ", ".join(Match.__slots__)
+SNAPSHOT_COLUMNS = ", ".join(Snapshot.__slots__)
+
+QUERIES = {
+    # players
+    "player": f"SELECT {PLAYER_COLUMNS} FROM players WHERE guild_id = $1 AND name = $2",
+    "all_players": f"SELECT {PLAYER_COLUMNS} FROM players WHERE guild_id = $1 ORDER BY rank_in_tier ASC",
+    "tier_players": f"SELECT {PLAYER_COLUMNS} FROM players WHERE guild_id = $1 AND tier = $2 ORDER BY rank_in_tier ASC",
+    "active_tier_players": f"SELECT {PLAYER_COLUMNS} FROM players WHERE guild_id = $1 AND tier = $2 AND (pending IS NULL OR pending = 0) ORDER BY rank_in_tier ASC",
+    "tier_counts": "SELECT tier, COUNT(*) AS players FROM players WHERE guild_id = $1 GROUP BY tier",
+    "player_tiers": "SELECT DISTINCT tier FROM players WHERE guild_id = $1 AND name IN ($2, $3)",
+    "add_player": "INSERT INTO players (guild_id, name, tier, rank_in_tier, wins, losses, goals, licensed, playstyle) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)",
+    "delete_player": "DELETE FROM players WHERE guild_id = $1 AND name = $2",
+    "set_rank": "UPDATE players SET rank_in_tier = $2 WHERE guild_id = $1 AND name = $3",
+    "bump_rank": "UPDATE players SET rank_in_tier = rank_in_tier + 1 WHERE guild_id = $1 AND tier = $2 AND rank_in_tier = $3 AND name != $4",
+    "set_stats": """
+        UPDATE players SET
+            wins = COALESCE($2, wins),
+            losses = COALESCE($3, losses),
+            goals = COALESCE($4, goals),
+            tier = COALESCE($5, tier),
+            rank_in_tier = COALESCE($6, rank_in_tier),
+            licensed = COALESCE($7, licensed),
+            playstyle = COALESCE($8, playstyle)
+        WHERE guild_id = $1 AND name = $9
+    """,
+    "move_pending": "UPDATE players SET tier = $2, pending = 1 WHERE guild_id = $1 AND name = $3",
+    "move_player": "UPDATE players SET tier = $2, round_wins = 0, round_losses = 0, round_done = 0 WHERE guild_id = $1 AND name = $3",
+    "fill_spot": "UPDATE players SET tier = $2, rank_in_tier = $3, round_wins = 0, round_losses = 0, round_done = 0 WHERE guild_id = $1 AND name = $4",
+    "reset_round": "UPDATE players SET round_wins = 0, round_losses = 0, round_done = 0 WHERE guild_id = $1 AND name = $2",
+    "reset_all_rounds": "UPDATE players SET round_wins = 0, round_losses = 0, round_done = 0, pending = 0 WHERE guild_id = $1",
+    # matches
+    "score": "SELECT cfi_score($1, $2, $3, $4, $5, $6, $7) AS result",
+    "last_match": f"""
+        SELECT {MATCH_COLUMNS} FROM matches
+        WHERE guild_id = $1 AND ((player1 = $2 AND player2 = $3) OR (player1 = $3 AND player2 = $2))
+        ORDER BY id DESC LIMIT 1
+    """,
+    "unscore_winner": """
+        UPDATE players SET
+            wins = GREATEST(wins - 1, 0),
+            goals = GREATEST(goals - $2, 0),
+            goals_against = GREATEST(goals_against - $3, 0),
+            round_wins = GREATEST(round_wins - 1, 0),
+            round_done = 0
+        WHERE guild_id = $1 AND name = $4
+    """,
+    "unscore_loser": """
+        UPDATE players SET
+            losses = GREATEST(losses - 1, 0),
+            goals = GREATEST(goals - $2, 0),
+            goals_against = GREATEST(goals_against - $3, 0),
+            round_losses = GREATEST(round_losses - 1, 0),
+            round_done = 0
+        WHERE guild_id = $1 AND name = $4
+    """,
+    "delete_match": "DELETE FROM matches WHERE guild_id = $1 AND id = $2",
+    # ranking snapshots
+    "latest_snapshots": f"SELECT {SNAPSHOT_COLUMNS} FROM ranking_snapshots WHERE guild_id = $1 ORDER BY version DESC LIMIT $2",
+    "snapshots": f"SELECT {SNAPSHOT_COLUMNS} FROM ranking_snapshots WHERE guild_id = $1 AND version = ANY($2::int[])",
+    # Ordered like the ladder ($2), then by rank within each tier; players are
+    # stored as get_uid() ids
+    "add_snapshot": """
+        INSERT INTO ranking_snapshots (guild_id, version, players, tiers)
+        SELECT $1,
+               (SELECT COALESCE(MAX(version), 0) + 1 FROM ranking_snapshots WHERE guild_id = $1),
+               COALESCE(array_agg(btrim(name, '<@> ') ORDER BY array_position($2::text[], tier), rank_in_tier), '{}'),
+               COALESCE(array_agg(tier ORDER BY array_position($2::text[], tier), rank_in_tier), '{}')
+        FROM players WHERE guild_id = $1 AND tier = ANY($2::text[])
+        RETURNING version
+    """,
+    "rank_history": """
+        SELECT version, taken_at, array_position(players, $2), array_length(players, 1),
+               tiers[array_position(players, $2)]
+        FROM ranking_snapshots
+        WHERE guild_id = $1 AND players @> ARRAY[$2::text]
+        ORDER BY version DESC LIMIT $3
+    """,
+    # season analytics, see ANALYTICS
+    "latest_version": "SELECT MAX(version) FROM ranking_snapshots WHERE guild_id = $1",
+    # Totals per tier, per playstyle and per licence in one pass
+    "analytics_groups": """
+        SELECT GROUPING(tier, playstyle, licensed), tier, playstyle, licensed,
+               COUNT(*), SUM(wins), SUM(losses), SUM(goals), SUM(goals_against)
+        FROM (
+            SELECT tier, COALESCE(playstyle, 'Unknown') AS playstyle, COALESCE(licensed, 'No') AS licensed,
+                   wins, losses, goals, goals_against
+            FROM players WHERE guild_id = $1
+        ) AS p
+        GROUP BY GROUPING SETS ((tier), (playstyle), (licensed))
+    """,
+    # Where everyone ended up one snapshot later, per tier they started in ($2 is the ladder)
+    "analytics_moves": """
+        WITH ranks AS (
+            SELECT s.version, r.name, r.tier
+            FROM ranking_snapshots s, unnest(s.players, s.tiers) AS r(name, tier)
+            WHERE s.guild_id = $1
+        )
+        SELECT a.tier, COUNT(*),
+               COUNT(*) FILTER (WHERE array_position($2::text[], b.tier) < array_position($2::text[], a.tier)),
+               COUNT(*) FILTER (WHERE array_position($2::text[], b.tier) > array_position($2::text[], a.tier))
+        FROM ranks a JOIN ranks b ON b.version = a.version + 1 AND b.name = a.name
+        GROUP BY a.tier
+    """,
+    "analytics_matches": """
+        SELECT COUNT(*), AVG(ABS(score1 - score2)), AVG(score1 + score2)
+        FROM matches WHERE guild_id = $1
+    """,
+    # per-guild settings
+    "guild_config": "SELECT guild_id, tiers, admin_roles, announcement_channel_id FROM guild_config WHERE guild_id = $1",
+    "set_guild_config": """
+        INSERT INTO guild_config (guild_id, tiers, admin_roles, announcement_channel_id) VALUES ($1, $2, $3, $4)
+        ON CONFLICT (guild_id) DO UPDATE SET
+            tiers = EXCLUDED.tiers,
+            admin_roles = EXCLUDED.admin_roles,
+            announcement_channel_id = EXCLUDED.announcement_channel_id
+    """,
+    # audit log
+    "audit_actions": """
+        SELECT MIN(id), actor, command, MIN(at), COUNT(*),
+               (array_agg(DISTINCT row_key) FILTER (WHERE table_name = 'players'))[1:5]
+        FROM audit_log
+        WHERE guild_id = $1 AND ($2::text IS NULL OR action IN (
+            SELECT action FROM audit_log WHERE guild_id = $1 AND table_name = 'players' AND row_key = $2
+        ))
+        GROUP BY action, actor, command
+        ORDER BY MIN(id) DESC LIMIT $3
+    """,
+    "audit_entry": """
+        SELECT table_name, row_key, before, after, actor, command, at FROM audit_log
+        WHERE guild_id = $1 AND action = (SELECT action FROM audit_log WHERE guild_id = $1 AND id = $2)
+        ORDER BY id
+    """,
+    "revert": "SELECT cfi_revert($1, $2)",
+    # bookkeeping
+    "claim_write": "INSERT INTO applied_writes (key) VALUES ($1) ON CONFLICT DO NOTHING",
+    "get_state": "SELECT value FROM bot_state WHERE key = $1",
+    "set_state": "INSERT INTO bot_state (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+    "cache_version": "SELECT version FROM cache_version WHERE id = 1",
+    "bump_version": "UPDATE cache_version SET version = version + 1 WHERE id = 1 RETURNING version",
+    "notify": "SELECT pg_notify($1, $2)",
+}
+
+_query_stats = {}  # statement name -> [executions, total seconds]
+
+def run(c, name, *params):
+    """Execute the named statement from QUERIES on cursor c."""
+    conn = c.connection
+    call = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+    fresh = name not in conn.prepared
+    if fresh:
+        # Prepare and execute in the same round trip
+        call = f"PREPARE {name} AS {QUERIES[name]}; {call}"
+    started = time.perf_counter()
+    try:
+        c.execute(call, params)
+    except DeadlineExceeded:
+        # Raised before anything was sent, so the session is unchanged
+        raise
+    except Exception:
+        if fresh:
+            # PREPARE isn't rolled back with the transaction, so we can't tell
+            # whether this session holds the statement now; don't reuse it
+            conn.reusable = False
+        raise
+    finally:
+        stats = _query_stats.setdefault(name, [0, 0.0])
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+    conn.prepared.add(name)
+
+def query_metrics():
+    with _pool_lock:
+        idle = sum(len(conns) for conns in _pools.values())
+    return {
+        "idle_connections": idle,
+        "statements": {
+            name: {"calls": calls, "total_ms": round(total * 1000, 1), "mean_ms": round(total / calls * 1000, 3)}
+            for name, (calls, total) in sorted(_query_stats.items())
+        },
+    }
+
+# ─────────────────────────────────────────
+# PLAYER CACHE
+# ─────────────────────────────────────────
+# Tier listings and server settings are cached per process and per guild.
+# Every write bumps cache_version and sends a NOTIFY naming its guild and
+# tiers inside its own transaction, so every process sharing the database
+# (bot, web API, failover) drops what changed. "*" means "everything in that
+# guild may have changed".
+_cache_lock = threading.Lock()
+_tier_cache = {}         # (guild, tier) -> players
+_guild_configs = {}      # guild -> settings, see guild_config()
+_known_configs = {}      # guild -> last settings read, used while the database is unreachable
+_cache_version = 0       # last cache_version this process has applied
+_cache_listening = False # the cache is only used while the listener is connected
+_cache_listener_started = False
+
+# Local version counters used to key rendered views (see RENDER CACHE).
+# _cache_epoch moves when the whole cache is dropped, _guild_epochs when one
+# guild's is, _tier_versions per tier.
+_cache_epoch = 0
+_guild_epochs = {}
+_tier_versions = {}      # (guild, tier) -> changes
+_league_changes = {}     # guild -> changes
+
+def _clear_cache():
+    """Drop everything cached. Caller holds _cache_lock."""
+    global _cache_epoch
+    _tier_cache.clear()
+    _guild_configs.clear()
+    _cache_epoch += 1
+
+def _clear_guild(guild):
+    """Drop everything cached for one guild. Caller holds _cache_lock."""
+    for key in [k for k in _tier_cache if k[0] == guild]:
+        del _tier_cache[key]
+    _guild_configs.pop(guild, None)
+    _guild_epochs[guild] = _guild_epochs.get(guild, 0) + 1
+
+def _drop_tier(guild, tier):
+    """Drop one cached tier. Caller holds _cache_lock."""
+    _tier_cache.pop((guild, tier), None)
+    _tier_versions[(guild, tier)] = _tier_versions.get((guild, tier), 0) + 1
+    _league_changes[guild] = _league_changes.get(guild, 0) + 1
+
+def tier_version(tier):
+    """Local version of a tier's data in the current guild; "*" for its whole league."""
+    guild = current_guild()
+    with _cache_lock:
+        epoch = (_cache_epoch, _guild_epochs.get(guild, 0))
+        if tier == "*":
+            return epoch + (_league_changes.get(guild, 0),)
+        return epoch + (_tier_versions.get((guild, tier), 0),)
+
+def publish_change(c, tiers):
+    """Bump cache_version and queue a NOTIFY for the given tiers of the current guild.
+
+    Must run in the writing transaction: Postgres only delivers the
+    notification if that transaction commits."""
+    run(c, "bump_version")
+    version = c.fetchone()[0]
+    payload = json.dumps({"v": version, "g": current_guild(), "t": sorted(set(tiers))}, separators=(",", ":"))
+    run(c, "notify", CACHE_CHANNEL, payload)
+    return version
+
+def apply_change(tiers, version, guild):
+    """Invalidate a guild's cached tiers for a change at the given version.
+
+    A guild of None (writes outside any interaction, like migrations) drops
+    every guild."""
+    global _cache_version
+    with _cache_lock:
+        if version <= _cache_version:
+            # Already applied: our own write coming back, or covered by a clear
+            return
+        if guild is None or version > _cache_version + 1:
+            # Either anything may have changed or we missed a notification in between
+            _clear_cache()
+        elif "*" in tiers:
+            _clear_guild(guild)
+        else:
+            for t in tiers:
+                _drop_tier(guild, t)
+        _cache_version = max(_cache_version, version)
+
+def patch_tier(tier, players, version):
+    """Cache rows a write just returned for a tier, instead of re-reading them."""
+    with _cache_lock:
+        if _cache_listening and _cache_version == version:
+            _tier_cache[(current_guild(), tier)] = players
+
+def commit_change(conn, c, tiers):
+    """Commit a write and invalidate the affected tiers everywhere."""
+    version = publish_change(c, tiers)
+    conn.commit()
+    note_write()
+    # Don't wait for our own notification to come back before dropping the cache
+    apply_change(tiers, version, current_guild())
+
+def resync_cache(c):
+    """Compare our version with the database and drop the cache if they differ."""
+    global _cache_version
+    run(c, "cache_version")
+    row = c.fetchone()
+    version = row[0] if row else 0
+    with _cache_lock:
+        if version != _cache_version:
+            _clear_cache()
+            _cache_version = version
+
+def cache_listener():
+    global _cache_listening
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(os.environ.get("DATABASE_URL"), connection_factory=BotConnection)
+            conn.autocommit = True
+            c = conn.cursor()
+            c.execute(f"LISTEN {CACHE_CHANNEL}")
+            resync_cache(c)
+            _cache_listening = True
+            print("🔔 Listening for cache invalidations")
+            while True:
+                if select.select([conn], [], [], CACHE_RESYNC_SECONDS) == ([], [], []):
+                    resync_cache(c)
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    data = json.loads(note.payload)
+                    apply_change(data["t"], data["v"], data.get("g"))
+        except Exception as e:
+            print(f"Cache listener error: {e}")
+        with _cache_lock:
+            _cache_listening = False
+            _clear_cache()
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        time.sleep(5)
+
+def start_cache_listener():
+    global _cache_listener_started
+    if _cache_listener_started:
+        return
+    _cache_listener_started = True
+    threading.Thread(target=cache_listener, daemon=True).start()
+
 # ─────────────────────────────────────────
 # HELPERS
 # ─────────────────────────────────────────
+def guild_config(guild=None):
+    """League settings of a guild (default: the current one): tier ladder,
+    admin roles and announcement channel. Servers that never ran /config get
+    the defaults from SETTINGS."""
+    guild = current_guild() if guild is None else guild
+    with _cache_lock:
+        cached = _guild_configs.get(guild) if _cache_listening else None
+        version = _cache_version
+    if cached is not None:
+        return cached
+
+    try:
+        conn = get_db(primary=_cache_listening)
+        c = conn.cursor()
+        run(c, "guild_config", guild)
+        row = c.fetchone()
+        conn.close()
+    except DB_BUSY_ERRORS:
+        # Keep admin checks working while the database is down, so writes
+        # can still be journaled
+        if guild in _known_configs:
+            return _known_configs[guild]
+        raise
+    config = dict(zip(("guild_id", "tiers", "admin_roles", "announcement_channel_id"), row)) if row else {
+        "guild_id": guild,
+        "tiers": list(TIERS),
+        "admin_roles": list(ADMIN_ROLES),
+        "announcement_channel_id": ANNOUNCEMENT_CHANNEL_ID if guild == LEGACY_GUILD_ID else 0,
+    }
+
+    _known_configs[guild] = config
+    with _cache_lock:
+        if _cache_listening and _cache_version == version:
+            _guild_configs[guild] = config
+    return config
+
+def guild_tiers():
+    """The current guild's tier ladder, highest first."""
+    return guild_config()["tiers"]
+
+def resolve_tier(tier: str):
+    """Match user input to one of the guild's tiers, ignoring case; None if there is no such tier."""
+    wanted = tier.strip().lower()
+    return next((t for t in guild_tiers() if t.lower() == wanted), None)
+
 def is_admin():
     async def predicate(interaction: discord.Interaction):
         user_roles = [role.name for role in interaction.user.roles]
-        if not any(r in user_roles for r in ADMIN_ROLES):
+        if not any(r in user_roles for r in guild_config()["admin_roles"]):
             await interaction.response.send_message("❌ You don't have admin permissions!", ephemeral=True)
             return False
         return True
     return app_commands.check(predicate)
 
+def can_manage_guild():
+    async def predicate(interaction: discord.Interaction):
+        if not interaction.permissions.manage_guild:
+            await interaction.response.send_message("❌ You need the Manage Server permission!", ephemeral=True)
+            return False
+        return True
+    return app_commands.check(predicate)
+
 def get_player(name: str):
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM players WHERE name = %s", (name,))
-    p = c.fetchone()
+    run(c, "player", current_guild(), name)
+    row = c.fetchone()
     conn.close()
-    return dict(p) if p else None
+    return Player(*row) if row else None
 
 def tier_index(tier: str):
     try:
-        return TIERS.index(tier)
+        return guild_tiers().index(tier)
     except ValueError:
         return -1
 
 def get_tier_players(tier: str):
-    conn = get_db()
+    guild = current_guild()
+    with _cache_lock:
+        cached = _tier_cache.get((guild, tier)) if _cache_listening else None
+        version = _cache_version
+    if cached is not None:
+        return list(cached)
+
+    # Fill the cache from the primary so it never holds rows a lagging replica
+    # hasn't caught up on yet. Without the listener there is no cache to fill.
+    conn = get_db(primary=_cache_listening)
     c = conn.cursor()
-    c.execute("SELECT * FROM players WHERE tier = %s AND (pending IS NULL OR pending = 0) ORDER BY rank_in_tier ASC", (tier,))
-    players = c.fetchall()
+    run(c, "active_tier_players", guild, tier)
+    players = [Player(*row) for row in c.fetchall()]
     conn.close()
-    return [dict(p) for p in players]
+
+    with _cache_lock:
+        # Only keep the result if nothing changed while we were reading it
+        if _cache_listening and _cache_version == version:
+            _tier_cache[(guild, tier)] = players
+    return list(players)
 
 def update_ranks_in_tier(tier: str):
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT name, wins, losses FROM players WHERE tier = %s", (tier,))
-    players = [dict(p) for p in c.fetchall()]
+    run(c, "tier_players", current_guild(), tier)
+    players = [Player(*row) for row in c.fetchall()]
 
-    def score(p):
-        total = p["wins"] + p["losses"]
-        return p["wins"] / total if total > 0 else 0
-
-    sorted_players = sorted(players, key=score, reverse=True)
+    sorted_players = sorted(players, key=lambda p: p.winrate, reverse=True)
     for i, p in enumerate(sorted_players):
-        c.execute("UPDATE players SET rank_in_tier = %s WHERE name = %s", (i + 1, p["name"]))
-    conn.commit()
+        run(c, "set_rank", current_guild(), i + 1, p.name)
+    commit_change(conn, c, [tier])
     conn.close()
 
 def get_valid_matchups(tier: str):
-    conn = get_db()
-    c = conn.cursor()
-    # Exclude pending and done players
-    c.execute("SELECT * FROM players WHERE tier = %s AND round_done = 0 AND (pending IS NULL OR pending = 0) ORDER BY rank_in_tier ASC", (tier,))
-    players = [dict(p) for p in c.fetchall()]
-    conn.close()
+    # Exclude pending and done players (get_tier_players already skips pending)
+    players = [p for p in get_tier_players(tier) if not p.round_done]
 
     if len(players) < 2:
         return []
 
     # Sort by rank_in_tier so position 0=rank1, 1=rank2, 2=rank3, 3=rank4
-    players = sorted(players, key=lambda p: p["rank_in_tier"])
+    players = sorted(players, key=lambda p: p.rank_in_tier)
 
     matchups = []
     paired = set()
@@ -179,12 +1323,12 @@ def get_valid_matchups(tier: str):
         if i < len(players) and j < len(players):
             p1 = players[i]
             p2 = players[j]
-            key1 = (p1["round_wins"], p1["round_losses"])
-            key2 = (p2["round_wins"], p2["round_losses"])
-            if key1 == key2 and p1["name"] not in paired and p2["name"] not in paired:
-                matchups.append((p1["name"], p2["name"], key1))
-                paired.add(p1["name"])
-                paired.add(p2["name"])
+            key1 = p1.round_record
+            key2 = p2.round_record
+            if key1 == key2 and p1.name not in paired and p2.name not in paired:
+                matchups.append((p1.name, p2.name, key1))
+                paired.add(p1.name)
+                paired.add(p2.name)
 
     if matchups:
         return matchups
@@ -193,18 +1337,18 @@ def get_valid_matchups(tier: str):
     # Winners final: both rank1 and rank3 won (1W/0L) → rank1 vs rank2... 
     # Actually: after round 1, winners play each other and losers play each other
     # Group remaining active players by record
-    remaining = [p for p in players if p["name"] not in paired]
+    remaining = [p for p in players if p.name not in paired]
     groups = {}
     for p in remaining:
-        key = (p["round_wins"], p["round_losses"])
+        key = p.round_record
         if key not in groups:
             groups[key] = []
-        groups[key].append(p["name"])
+        groups[key].append(p.name)
 
     for key, names in groups.items():
         if len(names) >= 2:
             # Sort by rank so highest ranked plays first
-            names_sorted = sorted(names, key=lambda n: next(p["rank_in_tier"] for p in players if p["name"] == n))
+            names_sorted = sorted(names, key=lambda n: next(p.rank_in_tier for p in players if p.name == n))
             matchups.append((names_sorted[0], names_sorted[1], key))
 
     return matchups
@@ -224,15 +1368,871 @@ async def get_display_name(guild: discord.Guild, uid: str) -> str:
         pass
     return f"<@{clean}>"
 
+def get_state(key: str):
+    conn = get_db()
+    c = conn.cursor()
+    run(c, "get_state", key)
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def set_state(key: str, value: str):
+    conn = get_db()
+    c = conn.cursor()
+    run(c, "set_state", key, value)
+    conn.commit()
+    conn.close()
+
 def get_uid(raw: str) -> str:
     """Always return a clean numeric ID from whatever is stored."""
     return raw.strip("<@>").strip()
 
 async def send_announcement(message: str):
-    if ANNOUNCEMENT_CHANNEL_ID and ANNOUNCEMENT_CHANNEL_ID != 0:
-        channel = bot.get_channel(ANNOUNCEMENT_CHANNEL_ID)
-        if channel:
-            await channel.send(message)
+    channel_id = guild_config()["announcement_channel_id"]
+    if channel_id:
+        queue_message(channel_id, message)
+
+# ─────────────────────────────────────────
+# OUTBOUND MESSAGES
+# ─────────────────────────────────────────
+# Channel messages go through one queue per channel. A worker waits a short
+# window to merge whatever else arrives, splits the result at Discord's size
+# limit and paces sends to stay under the per-channel rate limit, so bursts
+# arrive in order instead of piling into 429 retries.
+MESSAGE_LIMIT = 2000
+EMBED_FIELD_LIMIT = 1024
+EMBED_TOTAL_LIMIT = 6000  # characters across title, description, fields and footer
+EMBED_FIELD_COUNT = 25
+
+_outbox = {}  # channel id -> asyncio.Queue of (text, time queued)
+_outbox_stats = {"queued": 0, "sent": 0, "merged": 0, "failed": 0}
+_outbox_latency = deque(maxlen=500)  # seconds from queueing to delivery
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT):
+    """Split text into chunks of at most limit characters, on line breaks where possible."""
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+def add_field_lines(embed: discord.Embed, name: str, lines, inline: bool = False):
+    """Add lines as one embed field, continuing in extra fields past the field size limit."""
+    for i, chunk in enumerate(split_message("\n".join(lines), EMBED_FIELD_LIMIT)):
+        embed.add_field(name=name if i == 0 else f"{name} (cont.)", value=chunk, inline=inline)
+
+async def send_chunked(interaction: discord.Interaction, message: str, **kwargs):
+    """Send a follow-up, split into several messages if it is too long for one."""
+    for chunk in split_message(message):
+        await interaction.followup.send(chunk, **kwargs)
+
+def split_embed(embed: discord.Embed):
+    """Split an embed into several that each fit Discord's total size and field
+    count limits. Continuations repeat the title; the footer goes on the last one."""
+    footer = embed.footer.text or ""
+    # Embed.copy() is shallow and would share the field list
+    pages = [discord.Embed.from_dict({k: v for k, v in embed.to_dict().items() if k not in ("fields", "footer")})]
+    for field in embed.fields:
+        page = pages[-1]
+        size = len(field.name) + len(field.value)
+        if page.fields and (len(page.fields) >= EMBED_FIELD_COUNT
+                            or len(page) + size + len(footer) > EMBED_TOTAL_LIMIT):
+            page = discord.Embed(title=f"{embed.title} (cont.)" if embed.title else None, color=embed.color)
+            pages.append(page)
+        page.add_field(name=field.name, value=field.value, inline=field.inline)
+    if footer:
+        pages[-1].set_footer(text=footer, icon_url=embed.footer.icon_url)
+    return pages
+
+async def send_embed(interaction: discord.Interaction, embed: discord.Embed, **kwargs):
+    """Reply with an embed, split over several messages if it is too big for one."""
+    for page in split_embed(embed):
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=page, **kwargs)
+        else:
+            await interaction.response.send_message(embed=page, **kwargs)
+
+def queue_message(channel_id: int, message: str):
+    queue = _outbox.get(channel_id)
+    if queue is None:
+        queue = _outbox[channel_id] = asyncio.Queue()
+        asyncio.get_running_loop().create_task(outbox_worker(channel_id, queue))
+    queue.put_nowait((message, time.monotonic()))
+    _outbox_stats["queued"] += 1
+
+async def outbox_worker(channel_id: int, queue: asyncio.Queue):
+    max_sends, per_seconds = CHANNEL_RATE_LIMIT
+    recent_sends = deque()
+    while True:
+        batch = [await queue.get()]
+        # Give the rest of a burst a moment to arrive, then send it as one
+        await asyncio.sleep(ANNOUNCE_MERGE_SECONDS)
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        _outbox_stats["merged"] += len(batch) - 1
+
+        for chunk in split_message("\n\n".join(text for text, _ in batch)):
+            now = time.monotonic()
+            while recent_sends and now - recent_sends[0] >= per_seconds:
+                recent_sends.popleft()
+            if len(recent_sends) >= max_sends:
+                await asyncio.sleep(per_seconds - (now - recent_sends[0]))
+            recent_sends.append(time.monotonic())
+            channel = bot.get_channel(channel_id)
+            try:
+                if channel is None:
+                    raise RuntimeError("channel not found")
+                await channel.send(chunk)
+                _outbox_stats["sent"] += 1
+            except Exception as e:
+                _outbox_stats["failed"] += 1
+                print(f"Outbound message to {channel_id} failed: {e}")
+
+        delivered = time.monotonic()
+        for _, queued_at in batch:
+            _outbox_latency.append(delivered - queued_at)
+
+def outbox_metrics():
+    latencies = sorted(_outbox_latency)
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000) if latencies else None
+    return {
+        **_outbox_stats,
+        "depth": {str(cid): q.qsize() for cid, q in list(_outbox.items())},
+        "latency_p50_ms": pct(0.50),
+        "latency_p99_ms": pct(0.99),
+    }
+
+# ─────────────────────────────────────────
+# WRITE JOURNAL
+# ─────────────────────────────────────────
+# /score, /unscore and /setstats don't fail when Postgres is down or slow.
+# If their write can't finish within JOURNAL_AFTER_MS, it is appended to a
+# local SQLite journal (fsync'd before the admin is told it was saved) and a
+# background drainer applies it once the database is back. Entries apply in
+# order; while a guild has queued writes its new ones queue behind them.
+# Every write carries the interaction id as an idempotency key, recorded in
+# applied_writes in the same transaction, so nothing is applied twice.
+# Writes that no longer fit when drained are reported in their channel.
+_journal = None
+_journal_lock = threading.Lock()
+_journal_wakeup = None  # asyncio.Event, set when an entry is added
+_journal_task = None
+_journal_stats = {"queued": 0, "applied": 0, "duplicates": 0, "conflicts": 0}
+
+def apply_score(guild, key, name1, name2, goals1, goals2, played):
+    conn = get_db()
+    try:
+        # cfi_score() is a single statement, so autocommit runs it as its own
+        # transaction without separate BEGIN/COMMIT round trips
+        conn.autocommit = True
+        c = conn.cursor()
+        run(c, "score", guild, name1, name2, goals1, goals2, played, key)
+        result = c.fetchone()[0]
+    finally:
+        conn.close()
+    for side in ("p1", "p2", "winner", "loser"):
+        if side in result:
+            result[side] = Player.from_json(result[side])
+    if result["status"] == "ok":
+        result["standings"] = [Player.from_json(p) for p in result["standings"]]
+        note_write()
+        apply_change([result["winner"].tier, result["loser"].tier], result["version"], guild)
+        patch_tier(result["tier"], result["standings"], result["version"])
+    return result
+
+def apply_unscore(guild, key, name1, name2):
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        run(c, "claim_write", key)
+        if c.rowcount == 0:
+            conn.rollback()
+            return {"status": "duplicate"}
+
+        # Find the last match between these two players
+        run(c, "last_match", guild, name1, name2)
+        row = c.fetchone()
+        if not row:
+            conn.rollback()
+            return {"status": "missing"}
+        match = Match(*row)
+
+        # Figure out winner from scores
+        if match.score1 > match.score2:
+            winner, loser = match.player1, match.player2
+            goals_winner, goals_loser = match.score1, match.score2
+        else:
+            winner, loser = match.player2, match.player1
+            goals_winner, goals_loser = match.score2, match.score1
+
+        # Reverse stats for both players and delete the match record
+        run(c, "unscore_winner", guild, goals_winner, goals_loser, winner)
+        run(c, "unscore_loser", guild, goals_loser, goals_winner, loser)
+        run(c, "delete_match", guild, match.id)
+
+        run(c, "player_tiers", guild, winner, loser)
+        commit_change(conn, c, [tier for (tier,) in c.fetchall()])
+    finally:
+        conn.close()
+    return {"status": "ok", "winner": winner}
+
+def apply_setstats(guild, key, uid, values):
+    wins, losses, goals, tier, rank, licensed, playstyle = values
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        run(c, "claim_write", key)
+        if c.rowcount == 0:
+            conn.rollback()
+            return {"status": "duplicate"}
+        run(c, "player", guild, uid)
+        row = c.fetchone()
+        if not row:
+            conn.rollback()
+            return {"status": "missing"}
+        p = Player(*row)
+
+        # Options left empty are passed as NULL and keep their current value
+        run(c, "set_stats", guild, *values, uid)
+
+        # If rank changed, fix conflicts in that tier
+        if rank is not None:
+            target_tier = tier if tier else p.tier
+            # Push any other player that has the same rank down by 1
+            run(c, "bump_rank", guild, target_tier, rank, uid)
+
+        commit_change(conn, c, [p.tier, tier or p.tier])
+    finally:
+        conn.close()
+    return {"status": "ok"}
+
+JOURNALED_WRITES = {
+    "score": apply_score,
+    "unscore": apply_unscore,
+    "setstats": apply_setstats,
+}
+
+def journal_db():
+    """The journal connection, opened on first use. Caller holds _journal_lock."""
+    global _journal
+    if _journal is None:
+        _journal = sqlite3.connect(JOURNAL_PATH, check_same_thread=False)
+        _journal.execute("PRAGMA journal_mode = WAL")
+        _journal.execute("PRAGMA synchronous = FULL")
+        _journal.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                write_key TEXT NOT NULL UNIQUE,
+                guild_id INTEGER NOT NULL,
+                channel_id INTEGER,
+                user_id INTEGER,
+                command TEXT NOT NULL,
+                args TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        # Journals from before auditing have no user_id column yet
+        try:
+            _journal.execute("ALTER TABLE journal ADD COLUMN user_id INTEGER")
+        except sqlite3.OperationalError:
+            pass
+        _journal.commit()
+    return _journal
+
+def journal_append(key, guild, channel_id, user_id, command, args) -> int:
+    """Durably queue a write; returns how many writes are now queued for the guild."""
+    with _journal_lock:
+        db = journal_db()
+        added = db.execute(
+            "INSERT OR IGNORE INTO journal (write_key, guild_id, channel_id, user_id, command, args, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, guild, channel_id, user_id, command, json.dumps(args), datetime.now().isoformat(timespec="seconds"))
+        ).rowcount
+        db.commit()
+        queued = db.execute("SELECT COUNT(*) FROM journal WHERE guild_id = ?", (guild,)).fetchone()[0]
+    _journal_stats["queued"] += added
+    if _journal_wakeup is not None:
+        _journal_wakeup.set()
+    return queued
+
+def journal_pending(guild=None) -> int:
+    with _journal_lock:
+        db = journal_db()
+        if guild is None:
+            return db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+        return db.execute("SELECT COUNT(*) FROM journal WHERE guild_id = ?", (guild,)).fetchone()[0]
+
+def journal_next():
+    with _journal_lock:
+        row = journal_db().execute(
+            "SELECT seq, write_key, guild_id, channel_id, user_id, command, args FROM journal ORDER BY seq LIMIT 1"
+        ).fetchone()
+    if row is None:
+        return None
+    seq, key, guild, channel_id, user_id, command, args = row
+    return {"seq": seq, "key": key, "guild_id": guild, "channel_id": channel_id, "user_id": user_id,
+            "command": command, "args": json.loads(args)}
+
+def journal_remove(seq):
+    with _journal_lock:
+        db = journal_db()
+        db.execute("DELETE FROM journal WHERE seq = ?", (seq,))
+        db.commit()
+
+def write_or_journal(interaction: discord.Interaction, command: str, **args):
+    """Apply a journaled command's write now, or queue it if the database can't
+    take it or the guild's earlier queued writes haven't been applied yet.
+
+    Returns the apply function's result, or status "journaled" with the number
+    of writes it was queued behind (0: the database is unavailable)."""
+    key = str(interaction.id)
+    behind = journal_pending(interaction.guild_id)
+    if not behind:
+        token = _statement_cap_ms.set(JOURNAL_AFTER_MS)
+        try:
+            return JOURNALED_WRITES[command](interaction.guild_id, key, **args)
+        except DB_BUSY_ERRORS as e:
+            print(f"📝 Database unavailable for /{command}, journaling it: {e}")
+        finally:
+            _statement_cap_ms.reset(token)
+    journal_append(key, interaction.guild_id, interaction.channel_id, interaction.user.id, command, args)
+    return {"status": "journaled", "behind": behind}
+
+async def send_journaled(interaction: discord.Interaction, result):
+    if result["behind"]:
+        msg = (f"📝 Your change was saved and will be applied right after the {result['behind']} "
+               "earlier change(s) still waiting.")
+    else:
+        msg = "📝 The database is unavailable right now. Your change was saved and will be applied automatically as soon as it's back."
+    if interaction.response.is_done():
+        await interaction.followup.send(msg)
+    else:
+        await interaction.response.send_message(msg)
+
+def journal_conflict(command, args, result):
+    """Why a drained write was not applied, or None if it was."""
+    status = result["status"]
+    if status in ("ok", "duplicate"):
+        return None
+    if command == "score":
+        reason = {
+            "missing": "one of the players no longer exists",
+            "record": "the players no longer have the same round record",
+            "done": "one of the players is already done with this round",
+        }[status]
+        return f"`/score` <@{args['name1']}> {args['goals1']} - {args['goals2']} <@{args['name2']}>: {reason}"
+    if command == "unscore":
+        return f"`/unscore` <@{args['name1']}> <@{args['name2']}>: no match found between them"
+    return f"`/{command}` <@{args['uid']}>: player not found"
+
+def drain_entry(entry):
+    """Apply one journal entry. Runs in a worker thread."""
+    _current_guild.set(entry["guild_id"])
+    audited = entry["command"] in AUDITED_COMMANDS
+    _audit_context.set(f"{int(entry['key'])}:{entry['user_id'] or 0}:{entry['command']}" if audited else None)
+    return JOURNALED_WRITES[entry["command"]](entry["guild_id"], entry["key"], **entry["args"])
+
+async def journal_drainer():
+    global _journal_wakeup
+    _journal_wakeup = asyncio.Event()
+    while True:
+        entry = await asyncio.to_thread(journal_next)
+        if entry is None:
+            _journal_wakeup.clear()
+            await _journal_wakeup.wait()
+            continue
+        try:
+            result = await asyncio.to_thread(drain_entry, entry)
+        except DB_BUSY_ERRORS as e:
+            print(f"📝 Journal drain waiting for the database: {e}")
+            await asyncio.sleep(JOURNAL_RETRY_SECONDS)
+            continue
+        except Exception as e:
+            # Not an outage: retrying won't help, so report it and move on
+            result = {"status": "error"}
+            conflict = f"`/{entry['command']}` failed: {e}"
+        else:
+            conflict = journal_conflict(entry["command"], entry["args"], result)
+        journal_remove(entry["seq"])
+        if conflict:
+            _journal_stats["conflicts"] += 1
+            print(f"⚠️ Queued write not applied: {conflict}")
+            if entry["channel_id"]:
+                queue_message(entry["channel_id"], f"⚠️ A change saved during a database outage couldn't be applied — {conflict}")
+        elif result["status"] == "duplicate":
+            _journal_stats["duplicates"] += 1
+        else:
+            _journal_stats["applied"] += 1
+            print(f"📝 Applied queued /{entry['command']}")
+
+def start_journal_drainer():
+    """Start draining writes queued by this or an earlier run, once per process."""
+    global _journal_task
+    if _journal_task is None:
+        _journal_task = asyncio.get_running_loop().create_task(journal_drainer())
+
+def journal_metrics():
+    return dict(_journal_stats, pending=journal_pending())
+
+# ─────────────────────────────────────────
+# RENDER CACHE
+# ─────────────────────────────────────────
+# Rendered views (embeds and message blocks) are kept per (view, guild, tier) along
+# with the tier version and display-name version they were built from. A view
+# is rebuilt only when one of those moved, so looking at an unchanged tier
+# skips both the queries and the string building.
+_render_cache = {}  # (view, guild, tier) -> (versions, rendered value)
+_name_versions = {}  # guild -> bumped whenever a member's display name there may have changed
+_names_epoch = 0     # bumped when any guild's names may have changed
+
+def bump_names(guild=None):
+    """Mark a guild's display names (default: every guild's) as possibly changed."""
+    global _names_epoch
+    if guild is None:
+        _names_epoch += 1
+    else:
+        _name_versions[guild] = _name_versions.get(guild, 0) + 1
+
+def name_version(guild):
+    return _names_epoch, _name_versions.get(guild, 0)
+
+def cached_render(view, tier: str, build, uses_names: bool = True):
+    """Return build()'s result for this view of a tier in the current guild,
+    reusing it while nothing changed.
+
+    Use tier "*" for views that cover the whole league."""
+    key = (view, current_guild(), tier)
+    versions = (tier_version(tier), name_version(key[1]) if uses_names else 0)
+    hit = _render_cache.get(key)
+    if _cache_listening and hit is not None and hit[0] == versions:
+        return hit[1]
+    value = build()
+    # Don't keep a result that raced with a change
+    if _cache_listening and versions == (tier_version(tier), name_version(key[1]) if uses_names else 0):
+        _render_cache[key] = (versions, value)
+    return value
+
+# ─────────────────────────────────────────
+# PLAYER SEARCH
+# ─────────────────────────────────────────
+# Player options autocomplete from an in-memory index of the guild's
+# registered players, so typing never waits on the database. Display names
+# come from the member cache. Queries of one or two characters are looked
+# up by word prefix; longer ones intersect the players sharing each trigram
+# and then check for the substring. Like rendered views, an index is keyed by
+# the league and display-name versions, and one query rebuilds it after
+# either moved.
+_player_indexes = {}  # guild -> PlayerIndex
+
+def trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class PlayerIndex:
+    """A guild's registered players, in ladder order, searchable by display name."""
+    __slots__ = ("versions", "players", "labels", "keys", "by_id", "prefixes", "trigrams")
+
+    def __init__(self, versions, players, labels):
+        self.versions = versions
+        self.players = players
+        self.labels = labels
+        self.keys = [label.lower() for label in labels]
+        self.by_id = {get_uid(p.name): i for i, p in enumerate(players)}  # ids as get_uid() returns them
+        self.prefixes = {}  # first 1 or 2 characters of any word -> player positions
+        self.trigrams = {}  # trigram of the lowercased name -> player positions
+        for i, key in enumerate(self.keys):
+            for word in key.split() + [get_uid(players[i].name)]:
+                self.prefixes.setdefault(word[:1], set()).add(i)
+                self.prefixes.setdefault(word[:2], set()).add(i)
+            for t in trigrams(key):
+                self.trigrams.setdefault(t, set()).add(i)
+
+    def label(self, player) -> str:
+        return self.labels[self.by_id[get_uid(player.name)]]
+
+    def get(self, uid):
+        i = self.by_id.get(uid)
+        return None if i is None else self.players[i]
+
+    def search(self, query: str, tier=None, active=False, exclude=None, limit=AUTOCOMPLETE_LIMIT):
+        """Best matches for what was typed so far: names starting with it, then
+        names with a word starting with it, then names containing it; ladder
+        order within each group."""
+        q = query.strip().lower()
+        if not q:
+            candidates = range(len(self.players))
+        elif q in self.by_id:
+            candidates = [self.by_id[q]]
+        elif len(q) < 3:
+            candidates = self.prefixes.get(q, ())
+        else:
+            sets = sorted((self.trigrams.get(t, set()) for t in trigrams(q)), key=len)
+            candidates = [i for i in sets[0].intersection(*sets[1:]) if q in self.keys[i]]
+        ranked = []
+        for i in candidates:
+            p = self.players[i]
+            if (tier is not None and p.tier != tier) or p.name == exclude:
+                continue
+            if active and (p.pending or p.round_done):
+                continue
+            key = self.keys[i]
+            group = 0 if key.startswith(q) else 1 if f" {q}" in f" {key}" else 2
+            ranked.append((group, i))
+        return [self.players[i] for _, i in heapq.nsmallest(limit, ranked)]
+
+def player_index(guild: discord.Guild) -> PlayerIndex:
+    """The search index of a guild's players, rebuilt if the league or a display name changed."""
+    versions = (tier_version("*"), name_version(guild.id))
+    index = _player_indexes.get(guild.id)
+    if _cache_listening and index is not None and index.versions == versions:
+        return index
+
+    try:
+        conn = get_db(primary=_cache_listening)
+        c = conn.cursor()
+        run(c, "all_players", guild.id)
+        players = [Player(*row) for row in c.fetchall()]
+        conn.close()
+    except DB_BUSY_ERRORS:
+        # Slightly stale suggestions beat none while the database is down
+        if index is not None:
+            return index
+        raise
+    ladder = {t: i for i, t in enumerate(guild_tiers())}
+    players.sort(key=lambda p: (ladder.get(p.tier, len(ladder)), p.rank_in_tier))
+    labels = []
+    for p in players:
+        member = guild.get_member(int(get_uid(p.name)))
+        labels.append(member.display_name if member else get_uid(p.name))
+    index = PlayerIndex(versions, players, labels)
+    # Don't keep an index that raced with a change
+    if _cache_listening and versions == (tier_version("*"), name_version(guild.id)):
+        _player_indexes[guild.id] = index
+    return index
+
+def resolve_player(interaction: discord.Interaction, value: str):
+    """Turn a player option into (id, display name) of a registered player.
+
+    Autocomplete sends the player's id (mentions work too), which is taken as
+    an id only if a registered player has it, so all-digit display names can
+    still be typed. Anything else must be a name typed out in full. Returns
+    None when no registered player matches."""
+    value = value.strip()
+    uid = get_uid(value)
+    # An out-of-date index still knows the ids it has (commands check the
+    # player still exists), so it is only rebuilt when the id isn't in it
+    index = _player_indexes.get(interaction.guild_id)
+    if index is None or index.get(uid) is None:
+        try:
+            index = player_index(interaction.guild)
+        except DB_BUSY_ERRORS:
+            if not uid.isdigit():
+                raise
+            # Names can't be checked without the database; let ids through
+            # so journaled commands still work
+            member = interaction.guild.get_member(int(uid))
+            return uid, member.display_name if member else uid
+    player = index.get(uid)
+    if player is not None:
+        return player.name, index.label(player)
+    named = [p for p in index.search(value) if index.label(p).lower() == value.lower()]
+    if len(named) != 1:
+        return None
+    return named[0].name, index.label(named[0])
+
+# ─────────────────────────────────────────
+# ANALYTICS
+# ─────────────────────────────────────────
+# Season statistics (promotion and demotion rates per tier, goal difference,
+# playstyle and licence performance) are aggregated in Postgres and cached
+# per guild, keyed by the ranking snapshot they describe. Every /updateall
+# starts a recompute in a background thread; /stats and /stats/<guild> on the
+# web server only ever read the cache, so no interaction waits on the
+# aggregation.
+_analytics_lock = threading.Lock()
+_analytics = {}          # guild -> report, see compute_analytics()
+_analytics_running = set()
+
+def rate(part, whole):
+    return round(part / whole, 3) if whole else None
+
+def group_stats(count, wins, losses, goals, goals_against):
+    games = wins + losses
+    return {
+        "players": count,
+        "games": games,
+        "winrate": rate(wins, games),
+        "goals_per_game": rate(goals, games),
+        "goal_diff_per_game": rate(goals - goals_against, games),
+    }
+
+def compute_analytics(guild, version):
+    """Aggregate the guild's league for snapshot `version`. Runs in a worker thread."""
+    _current_guild.set(guild)
+    tiers = guild_config(guild)["tiers"]
+    conn = get_db()
+    c = conn.cursor()
+    run(c, "analytics_groups", guild)
+    groups = c.fetchall()
+    run(c, "analytics_moves", guild, tiers)
+    moves = {tier: (total, up, down) for tier, total, up, down in c.fetchall()}
+    run(c, "analytics_matches", guild)
+    played, margin, goals = c.fetchone()
+    conn.close()
+
+    # GROUPING() has a bit set for each column the row is not grouped by
+    by_tier = {row[1]: row[4:] for row in groups if row[0] == 0b011}
+    report = {
+        "snapshot": version,
+        "computed_at": datetime.now().isoformat(timespec="seconds"),
+        "tiers": [],
+        "playstyles": {row[2]: group_stats(*row[4:]) for row in groups if row[0] == 0b101},
+        "licensed": {row[3]: group_stats(*row[4:]) for row in groups if row[0] == 0b110},
+        "matches": {
+            "played": played,
+            "avg_margin": round(float(margin), 2) if margin is not None else None,
+            "avg_goals": round(float(goals), 2) if goals is not None else None,
+        },
+    }
+    for tier in tiers:
+        total, up, down = moves.get(tier, (0, 0, 0))
+        stats = group_stats(*by_tier[tier]) if tier in by_tier else group_stats(0, 0, 0, 0, 0)
+        stats.update(tier=tier, moves=total, promotion_rate=rate(up, total), demotion_rate=rate(down, total))
+        report["tiers"].append(stats)
+    return report
+
+def refresh_analytics(guild, version):
+    """Recompute a guild's report for `version` in the background, unless it is cached or already running."""
+    with _analytics_lock:
+        cached = _analytics.get(guild)
+        if (cached is not None and cached["snapshot"] >= version) or guild in _analytics_running:
+            return
+        _analytics_running.add(guild)
+
+    def work():
+        started = time.perf_counter()
+        try:
+            report = compute_analytics(guild, version)
+        except Exception as e:
+            print(f"📊 Analytics for guild {guild} failed: {e}")
+            return
+        finally:
+            with _analytics_lock:
+                _analytics_running.discard(guild)
+        with _analytics_lock:
+            cached = _analytics.get(guild)
+            if cached is None or cached["snapshot"] <= version:
+                _analytics[guild] = report
+        print(f"📊 Analytics for guild {guild} snapshot #{version} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    threading.Thread(target=work, daemon=True).start()
+
+def analytics_report(guild):
+    """(cached report or None, latest snapshot version or None). Starts a
+    recompute if the cache is behind the latest snapshot."""
+    conn = get_db()
+    c = conn.cursor()
+    run(c, "latest_version", guild)
+    version = c.fetchone()[0]
+    conn.close()
+    if version is not None:
+        refresh_analytics(guild, version)
+    with _analytics_lock:
+        return _analytics.get(guild), version
+
+# ─────────────────────────────────────────
+# TRAFFIC RECORDER
+# ─────────────────────────────────────────
+# Opt-in: with TRACE_FILE set, every slash command appends one JSON line with
+# its arrival time, options and duration. Users are replaced by salted
+# pseudonyms so traces can be shared and replayed with replay.py.
+TRACE_FILE = os.environ.get("TRACE_FILE")
+_trace_salt = os.environ.get("TRACE_SALT") or os.urandom(8).hex()
+_trace_started = {}  # interaction id -> (wall clock arrival, perf_counter arrival)
+
+def pseudonym(user_id) -> str:
+    return "u" + hashlib.sha256(f"{_trace_salt}:{user_id}".encode()).hexdigest()[:12]
+
+def anonymize(value, player=False):
+    """Make an option value safe to share. player=True marks a player option, which holds a user id."""
+    if hasattr(value, "id") and hasattr(value, "display_name"):
+        return {"member": pseudonym(value.id)}
+    if player and isinstance(value, str):
+        return {"member": pseudonym(get_uid(value))}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def write_trace(record: dict):
+    with open(TRACE_FILE, "a") as f:
+        f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+def start_trace(interaction: discord.Interaction):
+    if TRACE_FILE and interaction.type == discord.InteractionType.application_command:
+        _trace_started[interaction.id] = (time.time(), time.perf_counter())
+
+def finish_trace(interaction: discord.Interaction, ok: bool = True):
+    started = _trace_started.pop(interaction.id, None)
+    if started is None or interaction.command is None:
+        return
+    arrived, t0 = started
+    try:
+        write_trace({
+            "t": round(arrived, 3),
+            "command": interaction.command.name,
+            "user": pseudonym(interaction.user.id),
+            "options": {name: anonymize(value, name in PLAYER_OPTIONS) for name, value in interaction.namespace},
+            "ms": round((time.perf_counter() - t0) * 1000, 1),
+            "ok": ok,
+        })
+    except Exception as e:
+        print(f"Trace write failed: {e}")
+
+# ─────────────────────────────────────────
+# PROFILER
+# ─────────────────────────────────────────
+# /profiler arms profiling for the next N runs of a command. While a run is
+# profiled, a thread samples the event loop's stack every few milliseconds
+# (cheap enough for production) and DB queries and Discord REST calls made by
+# that interaction are timed. The samples are written as a collapsed-stack
+# file for flamegraph.pl/speedscope, and a summary goes to the admin who
+# armed it. Samples cover everything on the loop, so other commands running
+# at the same time can show up in the flamegraph.
+_profile_armed = {}     # command name -> (runs left, interaction that armed it)
+_profile_sessions = {}  # interaction id -> ProfileSession
+
+class ProfileSession:
+    def __init__(self, command: str, armed_by: discord.Interaction):
+        self.command = command
+        self.armed_by = armed_by
+        self.db_calls = 0
+        self.db_connects = 0
+        self.db_time = 0.0
+        self.http_calls = 0
+        self.http_time = 0.0
+        self.samples = Counter()  # tuple of code objects, root first -> count
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        self._stop.set()
+        self._sampler.join()
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_kind(stack) -> str:
+    if TimedCursor.execute.__code__ in stack:
+        return "db"
+    if os.path.basename(stack[-1].co_filename) in ("selectors.py", "base_events.py"):
+        return "idle"
+    return "python"
+
+def write_profile(session: ProfileSession) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{session.command}-{datetime.now():%Y%m%d-%H%M%S}.folded")
+    with open(path, "w") as f:
+        for stack, count in session.samples.items():
+            f.write(";".join(frame_label(code) for code in stack) + f" {count}\n")
+    return path
+
+def profile_summary(session: ProfileSession, path: str) -> str:
+    kinds = Counter()
+    hot = Counter()
+    for stack, count in session.samples.items():
+        kind = sample_kind(stack)
+        kinds[kind] += count
+        if kind == "python":
+            hot[frame_label(stack[-1])] += count
+    total = sum(kinds.values()) or 1
+    lines = [
+        f"🔬 **Profile of /{session.command}** — {session.elapsed * 1000:.0f} ms",
+        f"🗄️ DB: {session.db_calls} queries, {session.db_connects} connections, {session.db_time * 1000:.0f} ms",
+        f"🌐 Discord REST: {session.http_calls} calls, {session.http_time * 1000:.0f} ms",
+        f"📊 Samples: {kinds['python'] * 100 // total}% Python, {kinds['db'] * 100 // total}% DB, "
+        f"{kinds['idle'] * 100 // total}% waiting on I/O ({total} samples)",
+    ]
+    if hot:
+        lines.append("🔥 Hottest Python frames:")
+        lines += [f"• `{label}` — {count} samples" for label, count in hot.most_common(5)]
+    lines.append(f"📁 `{path}`")
+    return "\n".join(lines)
+
+def start_profile(interaction: discord.Interaction):
+    command = interaction.command
+    if command is None or interaction.type != discord.InteractionType.application_command:
+        return
+    armed = _profile_armed.get(command.name) or _profile_armed.get("*")
+    if armed is None or _profile_sessions:
+        # One profile at a time, otherwise the samples are meaningless
+        return
+    key = command.name if command.name in _profile_armed else "*"
+    runs_left, armed_by = armed
+    if runs_left <= 1:
+        del _profile_armed[key]
+    else:
+        _profile_armed[key] = (runs_left - 1, armed_by)
+    session = ProfileSession(command.name, armed_by)
+    _profile_sessions[interaction.id] = session
+    _current_profile.set(session)
+
+async def finish_profile(interaction: discord.Interaction):
+    session = _profile_sessions.pop(interaction.id, None)
+    if session is None:
+        return
+    session.stop()
+    _current_profile.set(None)
+    path = write_profile(session)
+    summary = profile_summary(session, path)
+    print(summary)
+    try:
+        await session.armed_by.followup.send(summary, ephemeral=True)
+    except discord.HTTPException:
+        # The arming interaction expired (15 minutes); DM the admin instead
+        try:
+            await session.armed_by.user.send(summary)
+        except discord.HTTPException as e:
+            print(f"Couldn't deliver profile summary: {e}")
+
+async def on_http_request_start(session, ctx, params):
+    ctx.profile = _current_profile.get()
+    ctx.started = time.perf_counter()
+
+async def on_http_request_end(session, ctx, params):
+    if ctx.profile is not None:
+        ctx.profile.http_calls += 1
+        ctx.profile.http_time += time.perf_counter() - ctx.started
+
+http_trace.on_request_start.append(on_http_request_start)
+http_trace.on_request_end.append(on_http_request_end)
+http_trace.on_request_exception.append(on_http_request_end)
 
 # ─────────────────────────────────────────
 # SLASH COMMANDS
@@ -256,9 +2256,41 @@ async def playstyle_autocomplete(interaction: discord.Interaction, current: str)
 async def tier_autocomplete(interaction: discord.Interaction, current: str):
     return [
         app_commands.Choice(name=tier, value=tier)
-        for tier in TIERS if current.lower() in tier.lower()
+        for tier in guild_tiers() if current.lower() in tier.lower()
     ]
 
+# Options that take a registered player (autocompleted from the player index)
+PLAYER_OPTIONS = {"player", "player1", "player2"}
+
+def player_choices(interaction: discord.Interaction, current: str, **filters):
+    index = player_index(interaction.guild)
+    return [
+        app_commands.Choice(name=f"{index.label(p)} — {p.tier} #{p.rank_in_tier}"[:100], value=get_uid(p.name))
+        for p in index.search(current, **filters)
+    ]
+
+async def player_autocomplete(interaction: discord.Interaction, current: str):
+    return player_choices(interaction, current)
+
+async def active_player_autocomplete(interaction: discord.Interaction, current: str):
+    """Players still playing this round."""
+    return player_choices(interaction, current, active=True)
+
+async def opponent_autocomplete(interaction: discord.Interaction, current: str):
+    """Active players, from player1's tier once player1 is picked."""
+    first = interaction.namespace.player1
+    p = player_index(interaction.guild).get(get_uid(first)) if first else None
+    if p is None:
+        return player_choices(interaction, current, active=True)
+    return player_choices(interaction, current, active=True, tier=p.tier, exclude=p.name)
+
+async def player_not_found(interaction: discord.Interaction, value: str):
+    msg = f"❌ **{value}** isn't a registered player! Pick one from the list."
+    if interaction.response.is_done():
+        await interaction.followup.send(msg)
+    else:
+        await interaction.response.send_message(msg, ephemeral=True)
+
 @tree.command(name="addplayer", description="Add a player to a tier (admin only)")
 @is_admin()
 @app_commands.describe(
@@ -275,8 +2307,8 @@ async def tier_autocomplete(interaction: discord.Interaction, current: str):
 async def addplayer(interaction: discord.Interaction, player: discord.Member, tier: str,
                     rank: int = None, wins: int = None, losses: int = None, goals: int = None,
                     licensed: str = None, playstyle: str = None):
-    tier = tier.title()
-    if tier not in TIERS:
+    tier = resolve_tier(tier)
+    if tier is None:
         await interaction.response.send_message("❌ Invalid tier!", ephemeral=True)
         return
 
@@ -307,27 +2339,29 @@ async def addplayer(interaction: discord.Interaction, player: discord.Member, ti
 
     conn = get_db()
     c = conn.cursor()
-    c.execute(
-        "INSERT INTO players (name, tier, rank_in_tier, wins, losses, goals, licensed, playstyle) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
-        (name, tier, rank, w, l, g, lic, ps)
-    )
-    conn.commit()
+    run(c, "add_player", interaction.guild_id, name, tier, rank, w, l, g, lic, ps)
+    commit_change(conn, c, [tier])
     conn.close()
     await interaction.response.send_message(f"✅ **{display}** added to **{tier}** as rank {rank}!")
 
 @tree.command(name="removeplayer", description="Remove a player (admin only)")
 @is_admin()
-@app_commands.describe(player="Select a Discord user")
-async def removeplayer(interaction: discord.Interaction, player: discord.Member):
-    name = str(player.id)
-    display = player.display_name
-    if not get_player(name):
+@app_commands.describe(player="Select a player")
+@app_commands.autocomplete(player=player_autocomplete)
+async def removeplayer(interaction: discord.Interaction, player: str):
+    resolved = resolve_player(interaction, player)
+    if resolved is None:
+        await player_not_found(interaction, player)
+        return
+    name, display = resolved
+    p = get_player(name)
+    if not p:
         await interaction.response.send_message(f"❌ **{display}** not found!", ephemeral=True)
         return
     conn = get_db()
     c = conn.cursor()
-    c.execute("DELETE FROM players WHERE name = %s", (name,))
-    conn.commit()
+    run(c, "delete_player", interaction.guild_id, name)
+    commit_change(conn, c, [p.tier])
     conn.close()
     await interaction.response.send_message(f"🗑️ **{display}** removed.")
 
@@ -339,96 +2373,82 @@ async def removeplayer(interaction: discord.Interaction, player: discord.Member)
     player2="Select player 2",
     goals2="Goals scored by player 2"
 )
-async def score(interaction: discord.Interaction, player1: discord.Member, goals1: int, player2: discord.Member, goals2: int):
+@app_commands.autocomplete(player1=active_player_autocomplete, player2=opponent_autocomplete)
+async def score(interaction: discord.Interaction, player1: str, goals1: int, player2: str, goals2: int):
     await interaction.response.defer()
 
-    name1 = str(player1.id)
-    name2 = str(player2.id)
-
-    p1 = get_player(name1)
-    p2 = get_player(name2)
+    resolved = [resolve_player(interaction, player1), resolve_player(interaction, player2)]
+    for value, found in zip((player1, player2), resolved):
+        if found is None:
+            await player_not_found(interaction, value)
+            return
+    (name1, display1), (name2, display2) = resolved
 
-    if not p1:
-        await interaction.followup.send(f"❌ {player1.display_name} not found!")
-        return
-    if not p2:
-        await interaction.followup.send(f"❌ {player2.display_name} not found!")
-        return
     if goals1 == goals2:
         await interaction.followup.send("❌ Draws are not allowed!")
         return
 
-    if (p1["round_wins"], p1["round_losses"]) != (p2["round_wins"], p2["round_losses"]):
+    result = write_or_journal(interaction, "score", name1=name1, name2=name2, goals1=goals1, goals2=goals2,
+                              played=datetime.now().isoformat())
+    if result["status"] == "journaled":
+        await send_journaled(interaction, result)
+        return
+
+    if result["status"] == "missing":
+        missing = display1 if result["player"] == 1 else display2
+        await interaction.followup.send(f"❌ {missing} not found!")
+        return
+    if result["status"] == "record":
+        p1, p2 = result["p1"], result["p2"]
         await interaction.followup.send(
-            f"❌ {player1.display_name} ({p1['round_wins']}W/{p1['round_losses']}L) and {player2.display_name} ({p2['round_wins']}W/{p2['round_losses']}L) don't have the same round record and can't face each other yet!"
+            f"❌ {display1} ({p1.round_wins}W/{p1.round_losses}L) and {display2} ({p2.round_wins}W/{p2.round_losses}L) don't have the same round record and can't face each other yet!"
         )
         return
-
-    if p1["round_done"] or p2["round_done"]:
+    if result["status"] == "done":
         await interaction.followup.send("❌ One of these players is already done with this round!")
         return
 
-    winner_name = name1 if goals1 > goals2 else name2
-    loser_name = name2 if goals1 > goals2 else name1
+    winner = result["winner"]
+    loser = result["loser"]
+    winner_name = winner.name
+    loser_name = loser.name
     winner_goals = max(goals1, goals2)
     loser_goals = min(goals1, goals2)
-
-    conn = get_db()
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO matches (player1, player2, score1, score2, date) VALUES (%s, %s, %s, %s, %s)",
-        (name1, name2, goals1, goals2, datetime.now().isoformat())
-    )
-
-    c.execute("""
-        UPDATE players SET wins = wins + 1, goals = goals + %s, goals_against = goals_against + %s,
-        round_wins = round_wins + 1 WHERE name = %s
-    """, (winner_goals, loser_goals, winner_name))
-    c.execute("""
-        UPDATE players SET losses = losses + 1, goals = goals + %s, goals_against = goals_against + %s,
-        round_losses = round_losses + 1 WHERE name = %s
-    """, (loser_goals, winner_goals, loser_name))
-
-    conn.commit()
-
-    c.execute("SELECT * FROM players WHERE name = %s", (winner_name,))
-    winner = dict(c.fetchone())
-    c.execute("SELECT * FROM players WHERE name = %s", (loser_name,))
-    loser = dict(c.fetchone())
+    tier = result["tier"]
 
     promo_msg = ""
     demo_msg = ""
 
-    if winner["round_wins"] >= 2:
-        c.execute("UPDATE players SET round_done = 1 WHERE name = %s", (winner_name,))
-        promo_msg = f"\n🎉 <@{get_uid(winner_name)}> has 2 wins — **PROMOTION** incoming! Use `/updatetier {winner['tier']}` to process."
+    if winner.round_wins >= 2:
+        promo_msg = f"\n🎉 <@{get_uid(winner_name)}> has 2 wins — **PROMOTION** incoming! Use `/updatetier {winner.tier}` to process."
 
-    if loser["round_losses"] >= 2:
-        c.execute("UPDATE players SET round_done = 1 WHERE name = %s", (loser_name,))
-        demo_msg = f"\n📉 <@{get_uid(loser_name)}> has 2 losses — **DEMOTION** incoming! Use `/updatetier {loser['tier']}` to process."
+    if loser.round_losses >= 2:
+        demo_msg = f"\n📉 <@{get_uid(loser_name)}> has 2 losses — **DEMOTION** incoming! Use `/updatetier {loser.tier}` to process."
 
-    conn.commit()
-    conn.close()
+    def build_standings():
+        standings = ""
+        for p in get_tier_players(tier):
+            status = "✅ Done" if p.round_done else "🎮 Active"
+            standings += f"• <@{get_uid(p.name)}>: {p.round_wins}W / {p.round_losses}L — {status}\n"
+        next_up = ""
+        matchups = get_valid_matchups(tier)
+        if matchups:
+            next_up += f"\n⚔️ **Next valid matchup(s):**\n"
+            for m in matchups:
+                next_up += f"• <@{get_uid(m[0])}> vs <@{get_uid(m[1])}> ({m[2][0]}W/{m[2][1]}L each)\n"
+        return standings, next_up
+
+    standings, next_up = cached_render("standings", tier, build_standings, uses_names=False)
 
     msg = f"⚽ **Match Result**\n"
     msg += f"🏆 <@{get_uid(winner_name)}> {winner_goals} - {loser_goals} <@{get_uid(loser_name)}>\n"
-    msg += f"\n📊 **Round Standings — {p1['tier']}:**\n"
-
-    tier_players = get_tier_players(p1["tier"])
-    for p in tier_players:
-        status = "✅ Done" if p["round_done"] else "🎮 Active"
-        msg += f"• <@{get_uid(p['name'])}>: {p['round_wins']}W / {p['round_losses']}L — {status}\n"
-
+    msg += f"\n📊 **Round Standings — {tier}:**\n"
+    msg += standings
     msg += promo_msg
     msg += demo_msg
+    msg += next_up
 
-    matchups = get_valid_matchups(p1["tier"])
-    if matchups:
-        msg += f"\n⚔️ **Next valid matchup(s):**\n"
-        for m in matchups:
-            msg += f"• <@{get_uid(m[0])}> vs <@{get_uid(m[1])}> ({m[2][0]}W/{m[2][1]}L each)\n"
-
-    await interaction.followup.send(msg, allowed_mentions=discord.AllowedMentions(users=True))
+    await send_chunked(interaction, msg, allowed_mentions=discord.AllowedMentions(users=True))
 
 
 @tree.command(name="unscore", description="Undo the last match between two players (admin only)")
@@ -437,74 +2457,28 @@ async def score(interaction: discord.Interaction, player1: discord.Member, goals
     player1="First player",
     player2="Second player"
 )
-async def unscore(interaction: discord.Interaction, player1: discord.Member, player2: discord.Member):
+@app_commands.autocomplete(player1=player_autocomplete, player2=player_autocomplete)
+async def unscore(interaction: discord.Interaction, player1: str, player2: str):
     await interaction.response.defer()
 
-    name1 = str(player1.id)
-    name2 = str(player2.id)
-
-    conn = get_db()
-    c = conn.cursor()
-
-    # Find the last match between these two players
-    c.execute("""
-        SELECT * FROM matches
-        WHERE (player1 = %s AND player2 = %s) OR (player1 = %s AND player2 = %s)
-        ORDER BY id DESC LIMIT 1
-    """, (name1, name2, name2, name1))
-    match = c.fetchone()
+    resolved = [resolve_player(interaction, player1), resolve_player(interaction, player2)]
+    for value, found in zip((player1, player2), resolved):
+        if found is None:
+            await player_not_found(interaction, value)
+            return
+    (name1, display1), (name2, display2) = resolved
 
-    if not match:
-        await interaction.followup.send(f"❌ No match found between {player1.display_name} and {player2.display_name}!")
-        conn.close()
+    result = write_or_journal(interaction, "unscore", name1=name1, name2=name2)
+    if result["status"] == "journaled":
+        await send_journaled(interaction, result)
         return
 
-    match = dict(match)
-    # Figure out winner from scores
-    if match["score1"] > match["score2"]:
-        winner = match["player1"]
-        loser = match["player2"]
-        goals_winner = match["score1"]
-        goals_loser = match["score2"]
-    else:
-        winner = match["player2"]
-        loser = match["player1"]
-        goals_winner = match["score2"]
-        goals_loser = match["score1"]
-
-    # Reverse stats for winner
-    c.execute("""
-        UPDATE players SET
-            wins = GREATEST(wins - 1, 0),
-            goals = GREATEST(goals - %s, 0),
-            goals_against = GREATEST(goals_against - %s, 0),
-            round_wins = GREATEST(round_wins - 1, 0),
-            round_done = 0
-        WHERE name = %s
-    """, (goals_winner, goals_loser, winner))
-
-    # Reverse stats for loser
-    c.execute("""
-        UPDATE players SET
-            losses = GREATEST(losses - 1, 0),
-            goals = GREATEST(goals - %s, 0),
-            goals_against = GREATEST(goals_against - %s, 0),
-            round_losses = GREATEST(round_losses - 1, 0),
-            round_done = 0
-        WHERE name = %s
-    """, (goals_loser, goals_winner, loser))
-
-    # Delete the match record
-    c.execute("DELETE FROM matches WHERE id = %s", (match["id"],))
-
-    conn.commit()
-    conn.close()
-
-    winner_display = player1.display_name if winner == name1 else player2.display_name
-    loser_display = player2.display_name if winner == name1 else player1.display_name
+    if result["status"] == "missing":
+        await interaction.followup.send(f"❌ No match found between {display1} and {display2}!")
+        return
 
     await interaction.followup.send(
-        f"↩️ Match undone between {player1.display_name} and {player2.display_name}!\n"
+        f"↩️ Match undone between {display1} and {display2}!\n"
         f"Stats reversed for both players."
     )
 
@@ -515,8 +2489,8 @@ async def unscore(interaction: discord.Interaction, player1: discord.Member, pla
 async def updatetier(interaction: discord.Interaction, tier: str):
     await interaction.response.defer()
 
-    tier = tier.title()
-    if tier not in TIERS:
+    tier = resolve_tier(tier)
+    if tier is None:
         await interaction.followup.send("❌ Invalid tier!")
         return
 
@@ -525,6 +2499,7 @@ async def updatetier(interaction: discord.Interaction, tier: str):
         await interaction.followup.send(f"❌ No players found in **{tier}**!")
         return
 
+    tiers = guild_tiers()
     results = []
     conn = get_db()
     c = conn.cursor()
@@ -533,36 +2508,30 @@ async def updatetier(interaction: discord.Interaction, tier: str):
     demo_list = []
 
     for p in players:
-        name = p["name"]
-        rw = p["round_wins"]
-        rl = p["round_losses"]
+        name = p.name
+        rw = p.round_wins
+        rl = p.round_losses
 
         if rw >= 2:
-            current_idx = tier_index(p["tier"])
+            current_idx = tier_index(p.tier)
             if current_idx > 0:
-                new_tier = TIERS[current_idx - 1]
+                new_tier = tiers[current_idx - 1]
                 # Move to new tier as pending — don't reset round stats yet
-                c.execute(
-                    "UPDATE players SET tier = %s, pending = 1 WHERE name = %s",
-                    (new_tier, name)
-                )
+                run(c, "move_pending", interaction.guild_id, new_tier, name)
                 promo_list.append((name, new_tier))
                 results.append(f"🎉 <@{get_uid(name)}> → **{new_tier}** (pending)")
             else:
                 results.append(f"🏅 <@{get_uid(name)}> is already in the highest tier!")
         elif rl >= 2:
-            current_idx = tier_index(p["tier"])
-            if current_idx < len(TIERS) - 1:
-                new_tier = TIERS[current_idx + 1]
+            current_idx = tier_index(p.tier)
+            if current_idx < len(tiers) - 1:
+                new_tier = tiers[current_idx + 1]
                 # Move to new tier as pending — don't reset round stats yet
-                c.execute(
-                    "UPDATE players SET tier = %s, pending = 1 WHERE name = %s",
-                    (new_tier, name)
-                )
+                run(c, "move_pending", interaction.guild_id, new_tier, name)
                 demo_list.append((name, new_tier))
                 results.append(f"📉 <@{get_uid(name)}> → **{new_tier}** (pending)")
             else:
-                c.execute("DELETE FROM players WHERE name = %s", (name,))
+                run(c, "delete_player", interaction.guild_id, name)
                 results.append(f"🚫 <@{get_uid(name)}> has been removed from the system (bottom of Bronze)")
         else:
             results.append(f"➡️ <@{get_uid(name)}>: {rw}W / {rl}L — no change")
@@ -570,16 +2539,16 @@ async def updatetier(interaction: discord.Interaction, tier: str):
     # Fix ranks in affected tiers
     affected_tiers = set([tier] + [t for _, t in promo_list] + [t for _, t in demo_list])
     for t in affected_tiers:
-        c.execute("SELECT * FROM players WHERE tier = %s ORDER BY rank_in_tier ASC", (t,))
-        tier_players = [dict(p) for p in c.fetchall()]
+        run(c, "tier_players", interaction.guild_id, t)
+        tier_players = [Player(*row) for row in c.fetchall()]
         promoted_into = [name for name, nt in promo_list if nt == t]
         demoted_into = [name for name, nt in demo_list if nt == t]
-        stayers = [p["name"] for p in tier_players if p["name"] not in promoted_into and p["name"] not in demoted_into]
+        stayers = [p.name for p in tier_players if p.name not in promoted_into and p.name not in demoted_into]
         ordered = demoted_into + stayers + promoted_into
         for i, name in enumerate(ordered):
-            c.execute("UPDATE players SET rank_in_tier = %s WHERE name = %s", (i + 1, name))
+            run(c, "set_rank", interaction.guild_id, i + 1, name)
 
-    conn.commit()
+    commit_change(conn, c, affected_tiers)
     conn.close()
 
     embed = discord.Embed(title=f"🔄 Tier Update — {tier}", color=0xff9900)
@@ -593,136 +2562,154 @@ async def updatetier(interaction: discord.Interaction, tier: str):
 @app_commands.describe(tier="Select a tier")
 @app_commands.autocomplete(tier=tier_autocomplete)
 async def bracket(interaction: discord.Interaction, tier: str):
-    tier = tier.title()
-    if tier not in TIERS:
+    tier = resolve_tier(tier)
+    if tier is None:
         await interaction.response.send_message("❌ Invalid tier!", ephemeral=True)
         return
 
-    players = get_tier_players(tier)
-    if not players:
-        await interaction.response.send_message(f"**{tier}** is empty.")
-        return
+    def build():
+        players = get_tier_players(tier)
+        if not players:
+            return None
 
-    embed = discord.Embed(title=f"⚔️ Round Bracket — {tier}", color=0xff4444)
+        embed = discord.Embed(title=f"⚔️ Round Bracket — {tier}", color=0xff4444)
 
-    lines = []
-    for p in players:
-        if p["round_done"]:
-            if p["round_wins"] >= 2:
-                status = "✅ PROMO (2W)"
+        lines = []
+        for p in players:
+            if p.round_done:
+                if p.round_wins >= 2:
+                    status = "✅ PROMO (2W)"
+                else:
+                    status = "❌ DEMO (2L)"
             else:
-                status = "❌ DEMO (2L)"
+                status = f"🎮 {p.round_wins}W / {p.round_losses}L"
+            member = interaction.guild.get_member(int(get_uid(p.name)))
+            name_str = member.display_name if member else get_uid(p.name)
+            lines.append(f"{name_str} — {status}")
+
+        embed.description = "\n".join(lines)
+
+        matchups = get_valid_matchups(tier)
+        if matchups:
+            def get_name(uid):
+                m = interaction.guild.get_member(int(get_uid(uid)))
+                return m.display_name if m else get_uid(uid)
+            next_matches = "\n".join([f"• {get_name(m[0])} vs {get_name(m[1])}" for m in matchups])
+            embed.add_field(name="⚔️ Next Matchup(s)", value=next_matches, inline=False)
         else:
-            status = f"🎮 {p['round_wins']}W / {p['round_losses']}L"
-        member = interaction.guild.get_member(int(get_uid(p["name"])))
-        name_str = member.display_name if member else get_uid(p["name"])
-        lines.append(f"{name_str} — {status}")
+            active = [p for p in players if not p.round_done]
+            if not active:
+                embed.add_field(name="✅ Round Complete!", value="Use `/updatetier` to process promos and demos.", inline=False)
+            else:
+                embed.add_field(name="⏳ Waiting...", value="Not enough players with the same record to make a match yet.", inline=False)
 
-    embed.description = "\n".join(lines)
+        embed.set_footer(text="2 wins = Promo | 2 losses = Demo")
+        return embed
 
-    matchups = get_valid_matchups(tier)
-    if matchups:
-        def get_name(uid):
-            m = interaction.guild.get_member(int(get_uid(uid)))
-            return m.display_name if m else get_uid(uid)
-        next_matches = "\n".join([f"• {get_name(m[0])} vs {get_name(m[1])}" for m in matchups])
-        embed.add_field(name="⚔️ Next Matchup(s)", value=next_matches, inline=False)
-    else:
-        active = [p for p in players if not p["round_done"]]
-        if not active:
-            embed.add_field(name="✅ Round Complete!", value="Use `/updatetier` to process promos and demos.", inline=False)
-        else:
-            embed.add_field(name="⏳ Waiting...", value="Not enough players with the same record to make a match yet.", inline=False)
-
-    embed.set_footer(text="2 wins = Promo | 2 losses = Demo")
+    embed = cached_render("bracket", tier, build)
+    if embed is None:
+        await interaction.response.send_message(f"**{tier}** is empty.")
+        return
     await interaction.response.send_message(embed=embed)
 
 @tree.command(name="tier", description="View all players in a tier")
 @app_commands.describe(tier="Select a tier")
 @app_commands.autocomplete(tier=tier_autocomplete)
 async def view_tier(interaction: discord.Interaction, tier: str):
-    tier = tier.title()
-    if tier not in TIERS:
+    tier = resolve_tier(tier)
+    if tier is None:
         await interaction.response.send_message("❌ Invalid tier!", ephemeral=True)
         return
 
-    players = get_tier_players(tier)
-    if not players:
+    def build():
+        players = get_tier_players(tier)
+        if not players:
+            return None
+
+        embed = discord.Embed(title=f"🏅 {tier}", color=0x00aaff)
+        lines_list = []
+        for p in players:
+            member = interaction.guild.get_member(int(get_uid(p.name)))
+            name_str = member.display_name if member else get_uid(p.name)
+            lines_list.append(f"{p.rank_in_tier}. {name_str}")
+        lines = chr(10).join(lines_list)
+        embed.description = lines
+        return embed
+
+    embed = cached_render("tier", tier, build)
+    if embed is None:
         await interaction.response.send_message(f"**{tier}** is empty.")
         return
-
-    embed = discord.Embed(title=f"🏅 {tier}", color=0x00aaff)
-    lines_list = []
-    for p in players:
-        member = interaction.guild.get_member(int(get_uid(p["name"])))
-        name_str = member.display_name if member else get_uid(p["name"])
-        lines_list.append(f"{p['rank_in_tier']}. {name_str}")
-    lines = chr(10).join(lines_list)
-    embed.description = lines
     await interaction.response.send_message(embed=embed)
 
 @tree.command(name="profile", description="View a player's profile")
 @app_commands.describe(player="Select a player")
-async def profile(interaction: discord.Interaction, player: discord.Member):
-    uid = str(player.id)
-    display_name = player.display_name
+@app_commands.autocomplete(player=player_autocomplete)
+async def profile(interaction: discord.Interaction, player: str):
+    resolved = resolve_player(interaction, player)
+    if resolved is None:
+        await player_not_found(interaction, player)
+        return
+    uid, display_name = resolved
     p = get_player(uid)
     if not p:
         await interaction.response.send_message(f"❌ **{display_name}** not found!", ephemeral=True)
         return
 
-    total = p["wins"] + p["losses"]
-    winrate = round((p["wins"] / total * 100)) if total > 0 else 0
-
     embed = discord.Embed(title=f"⚽ {display_name}", color=0xffaa00)
-    embed.set_thumbnail(url=player.display_avatar.url)
-    licensed = p.get("licensed", "No")
-    playstyle = p.get("playstyle", "Balanced")
+    member = interaction.guild.get_member(int(get_uid(uid)))
+    if member:
+        embed.set_thumbnail(url=member.display_avatar.url)
     embed.description = (
-        f"**Tier:** {p['tier']}\n"
-        f"**Current Rank:** {p['rank_in_tier']}\n"
-        f"**Wins:** {p['wins']}\n"
-        f"**Losses:** {p['losses']}\n"
-        f"**Goals Scored:** {p['goals']}\n"
-        f"**Winrate:** {winrate}%\n"
-        f"**Matches Played:** {total}\n"
-        f"**Licensed:** {licensed}\n"
-        f"**Playstyle:** {playstyle}"
+        f"**Tier:** {p.tier}\n"
+        f"**Current Rank:** {p.rank_in_tier}\n"
+        f"**Wins:** {p.wins}\n"
+        f"**Losses:** {p.losses}\n"
+        f"**Goals Scored:** {p.goals}\n"
+        f"**Winrate:** {round(p.winrate * 100)}%\n"
+        f"**Matches Played:** {p.total}\n"
+        f"**Licensed:** {p.licensed}\n"
+        f"**Playstyle:** {p.playstyle}"
     )
     await interaction.response.send_message(embed=embed)
 
 @tree.command(name="alltiers", description="Overview of all tiers and their players")
 async def alltiers(interaction: discord.Interaction):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM players ORDER BY rank_in_tier")
-    all_players = [dict(p) for p in c.fetchall()]
-    conn.close()
+    def build():
+        # Rendered results are cached, so read them from the primary (see get_tier_players)
+        conn = get_db(primary=_cache_listening)
+        c = conn.cursor()
+        run(c, "all_players", interaction.guild_id)
+        all_players = [Player(*row) for row in c.fetchall()]
+        conn.close()
 
-    if not all_players:
+        if not all_players:
+            return None
+
+        embed = discord.Embed(title="🌍 CFI Ranking", color=0x00ff88)
+        tier_data = {}
+        for p in all_players:
+            if p.tier not in tier_data:
+                tier_data[p.tier] = []
+            tier_data[p.tier].append(p)
+
+        global_rank = 1
+        for tier in guild_tiers():
+            if tier in tier_data:
+                lines = []
+                for p in tier_data[tier]:
+                    uid = get_uid(p.name)
+                    lines.append(f"{global_rank}. <@{uid}>" + chr(10) + f"W: {p.wins} | L: {p.losses} | Goals: {p.goals} | Winrate: {round(p.winrate * 100)}%")
+                    global_rank += 1
+                add_field_lines(embed, tier, lines)
+        return embed
+
+    embed = cached_render("alltiers", "*", build, uses_names=False)
+    if embed is None:
         await interaction.response.send_message("There are no players yet!")
         return
 
-    embed = discord.Embed(title="🌍 CFI Ranking", color=0x00ff88)
-    tier_data = {}
-    for p in all_players:
-        if p["tier"] not in tier_data:
-            tier_data[p["tier"]] = []
-        tier_data[p["tier"]].append(p)
-
-    global_rank = 1
-    for tier in TIERS:
-        if tier in tier_data:
-            lines = []
-            for p in tier_data[tier]:
-                total = p["wins"] + p["losses"]
-                winrate = round((p["wins"] / total * 100)) if total > 0 else 0
-                uid = get_uid(p["name"])
-                lines.append(f"{global_rank}. <@{uid}>" + chr(10) + f"W: {p['wins']} | L: {p['losses']} | Goals: {p['goals']} | Winrate: {winrate}%")
-                global_rank += 1
-            embed.add_field(name="​", value=f"**{tier}**" + chr(10) + chr(10).join(lines), inline=False)
-
-    await interaction.response.send_message(embed=embed)
+    await send_embed(interaction, embed)
 
 
 @tree.command(name="updateall", description="Process all promos and demos for every tier at once (admin only)")
@@ -732,8 +2719,8 @@ async def updateall(interaction: discord.Interaction):
 
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM players")
-    all_players = [dict(p) for p in c.fetchall()]
+    run(c, "all_players", interaction.guild_id)
+    all_players = [Player(*row) for row in c.fetchall()]
     conn.close()
 
     if not all_players:
@@ -741,17 +2728,18 @@ async def updateall(interaction: discord.Interaction):
         return
 
     # First collect all moves so we don't process cascading changes
+    tiers = guild_tiers()
     moves = {}
     for p in all_players:
-        name = p["name"]
-        rw = p["round_wins"]
-        rl = p["round_losses"]
-        current_idx = tier_index(p["tier"])
+        name = p.name
+        rw = p.round_wins
+        rl = p.round_losses
+        current_idx = tier_index(p.tier)
 
         if rw >= 2 and current_idx > 0:
-            moves[name] = ("promo", TIERS[current_idx - 1])
-        elif rl >= 2 and current_idx < len(TIERS) - 1:
-            moves[name] = ("demo", TIERS[current_idx + 1])
+            moves[name] = ("promo", tiers[current_idx - 1])
+        elif rl >= 2 and current_idx < len(tiers) - 1:
+            moves[name] = ("demo", tiers[current_idx + 1])
 
     # Apply all moves at once
     conn = get_db()
@@ -762,56 +2750,39 @@ async def updateall(interaction: discord.Interaction):
     none_list = []
 
     for p in all_players:
-        name = p["name"]
+        name = p.name
         if name in moves:
             move_type, new_tier = moves[name]
-            c.execute(
-                "UPDATE players SET tier = %s, round_wins = 0, round_losses = 0, round_done = 0 WHERE name = %s",
-                (new_tier, name)
-            )
+            run(c, "move_player", interaction.guild_id, new_tier, name)
             if move_type == "promo":
                 promo_list.append((name, new_tier))
             else:
                 demo_list.append((name, new_tier))
         else:
-            c.execute(
-                "UPDATE players SET round_wins = 0, round_losses = 0, round_done = 0 WHERE name = %s",
-                (name,)
-            )
+            run(c, "reset_round", interaction.guild_id, name)
             none_list.append(f"➡️ <@{name}>")
 
-    conn.commit()
-
     # Reset all round stats and clear pending for everyone
-    c.execute("UPDATE players SET round_wins = 0, round_losses = 0, round_done = 0, pending = 0")
-    conn.commit()
+    run(c, "reset_all_rounds", interaction.guild_id)
 
-    # Save new ranking snapshot to overview_ranking
-    c.execute("SELECT * FROM players ORDER BY rank_in_tier ASC")
-    all_players_after = [dict(p) for p in c.fetchall()]
-    c.execute("DELETE FROM overview_ranking")
-    position = 1
-    for tier in TIERS:
-        for p in [x for x in all_players_after if x["tier"] == tier]:
-            c.execute(
-                "INSERT INTO overview_ranking (position, player_id, tier) VALUES (%s, %s, %s)",
-                (position, get_uid(p["name"]), tier)
-            )
-            position += 1
-    conn.commit()
+    # Append the new ranking as a snapshot, built server-side in one statement
+    run(c, "add_snapshot", interaction.guild_id, tiers)
+    snapshot = c.fetchone()[0]
+    commit_change(conn, c, ["*"])
     conn.close()
+    refresh_analytics(interaction.guild_id, snapshot)
 
     embed = discord.Embed(title="🔄 Full Ranking Update", color=0xff9900)
 
     if promo_list:
-        embed.add_field(name="🎉 Promotions", value="\n".join([f"🎉 <@{n}> → **{t}**" for n, t in promo_list]), inline=False)
+        add_field_lines(embed, "🎉 Promotions", [f"🎉 <@{n}> → **{t}**" for n, t in promo_list])
     if demo_list:
-        embed.add_field(name="📉 Demotions", value="\n".join([f"📉 <@{n}> → **{t}**" for n, t in demo_list]), inline=False)
+        add_field_lines(embed, "📉 Demotions", [f"📉 <@{n}> → **{t}**" for n, t in demo_list])
     if none_list:
-        embed.add_field(name="➡️ No change", value="\n".join(none_list), inline=False)
+        add_field_lines(embed, "➡️ No change", none_list)
 
-    embed.set_footer(text="All round stats reset. New round can begin!")
-    await interaction.followup.send(embed=embed)
+    embed.set_footer(text=f"All round stats reset. New round can begin! Ranking saved as snapshot #{snapshot}.")
+    await send_embed(interaction, embed)
 
 
 
@@ -821,45 +2792,179 @@ async def overview(interaction: discord.Interaction):
 
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM overview_ranking ORDER BY position ASC")
-    rows = [dict(r) for r in c.fetchall()]
+    run(c, "latest_snapshots", interaction.guild_id, 1)
+    row = c.fetchone()
     conn.close()
 
-    if not rows:
+    if not row:
         await interaction.followup.send("No overview available yet. Run /updateall first!")
         return
 
     # Get player stats from players table
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM players")
-    all_players = {p["name"]: dict(p) for p in c.fetchall()}
+    run(c, "all_players", interaction.guild_id)
+    all_players = {get_uid(p.name): p for p in (Player(*row) for row in c.fetchall())}
     conn.close()
 
+    snapshot = Snapshot(*row)
     tier_data = {}
-    for r in rows:
-        t = r["tier"]
+    for player_id, t in zip(snapshot.players, snapshot.tiers):
         if t not in tier_data:
             tier_data[t] = []
-        tier_data[t].append(r["player_id"])
+        tier_data[t].append(player_id)
 
     global_rank = 1
     message = "🌍 **CFI Ranking**" + chr(10)
-    for tier in TIERS:
+    for tier in guild_tiers():
         if tier in tier_data:
             message += chr(10) + f"**{tier}**" + chr(10)
             for uid in tier_data[tier]:
                 p = all_players.get(uid)
                 if p:
-                    total = p["wins"] + p["losses"]
-                    winrate = round((p["wins"] / total * 100)) if total > 0 else 0
                     message += f"{global_rank}. <@{uid}>" + chr(10)
-                    message += f"W: {p['wins']} | L: {p['losses']} | Goals: {p['goals']} | Winrate: {winrate}%" + chr(10)
+                    message += f"W: {p.wins} | L: {p.losses} | Goals: {p.goals} | Winrate: {round(p.winrate * 100)}%" + chr(10)
                 else:
                     message += f"{global_rank}. <@{uid}>" + chr(10)
                 global_rank += 1
 
-    await interaction.followup.send(message, allowed_mentions=discord.AllowedMentions(users=True))
+    await send_chunked(interaction, message, allowed_mentions=discord.AllowedMentions(users=True))
+
+@tree.command(name="rankhistory", description="Chart a player's overall rank across the saved rankings")
+@app_commands.describe(player="Select a player")
+@app_commands.autocomplete(player=player_autocomplete)
+async def rankhistory(interaction: discord.Interaction, player: str):
+    resolved = resolve_player(interaction, player)
+    if resolved is None:
+        await player_not_found(interaction, player)
+        return
+    uid, display = resolved
+    conn = get_db()
+    c = conn.cursor()
+    run(c, "rank_history", interaction.guild_id, get_uid(uid), RANK_HISTORY_LIMIT)
+    rows = c.fetchall()[::-1]
+    conn.close()
+
+    if not rows:
+        await interaction.response.send_message(f"❌ **{display}** isn't in any saved ranking yet!", ephemeral=True)
+        return
+
+    # One bar per snapshot, longer is better
+    lines = []
+    for version, taken_at, position, size, tier in rows:
+        bar = "█" * max(1, round((size - position + 1) / size * 16))
+        lines.append(f"#{version:<4} {taken_at:%d/%m} {bar:<16} {position:>3}/{size:<3} {tier}")
+
+    first, latest = rows[0], rows[-1]
+    best = min(rows, key=lambda r: r[2])
+    change = first[2] - latest[2]
+    trend = f"▲ {change}" if change > 0 else f"▼ {-change}" if change < 0 else "no change"
+
+    embed = discord.Embed(title=f"📈 Rank History — {display}", color=0x00ff88)
+    embed.description = "```\n" + "\n".join(lines) + "\n```"
+    embed.add_field(name="Now", value=f"#{latest[2]} ({latest[4]})", inline=True)
+    embed.add_field(name="Best", value=f"#{best[2]} (snapshot #{best[0]})", inline=True)
+    embed.add_field(name="Since #" + str(first[0]), value=trend, inline=True)
+    embed.set_footer(text=f"Last {len(rows)} ranking(s) saved by /updateall")
+    await interaction.response.send_message(embed=embed)
+
+@tree.command(name="rankdiff", description="Show who moved between two saved rankings (admin only)")
+@is_admin()
+@app_commands.describe(
+    from_snapshot="Older snapshot number (default: the one before to_snapshot)",
+    to_snapshot="Newer snapshot number (default: the latest)"
+)
+async def rankdiff(interaction: discord.Interaction, from_snapshot: int = None, to_snapshot: int = None):
+    conn = get_db()
+    c = conn.cursor()
+    if to_snapshot is None:
+        run(c, "latest_snapshots", interaction.guild_id, 1)
+        row = c.fetchone()
+        to_snapshot = row[0] if row else 0
+    if from_snapshot is None:
+        from_snapshot = to_snapshot - 1
+    run(c, "snapshots", interaction.guild_id, [from_snapshot, to_snapshot])
+    snapshots = {s.version: s for s in (Snapshot(*row) for row in c.fetchall())}
+    conn.close()
+
+    if from_snapshot == to_snapshot:
+        await interaction.response.send_message("❌ Pick two different snapshots!", ephemeral=True)
+        return
+    missing = [f"#{v}" for v in (from_snapshot, to_snapshot) if v not in snapshots]
+    if missing:
+        await interaction.response.send_message(f"❌ Snapshot {' and '.join(missing)} not found! Every /updateall saves one.", ephemeral=True)
+        return
+
+    before, after = snapshots[from_snapshot], snapshots[to_snapshot]
+    old = before.positions()
+    new = after.positions()
+    moves = []
+    unchanged = 0
+    for name, (position, tier) in new.items():
+        if name not in old:
+            moves.append(f"🆕 <@{name}> #{position} ({tier})")
+            continue
+        old_position, old_tier = old[name]
+        if (old_position, old_tier) == (position, tier):
+            unchanged += 1
+            continue
+        arrow = "⬆️" if position < old_position else "⬇️" if position > old_position else "↔️"
+        where = f"{old_tier} → {tier}" if old_tier != tier else tier
+        moves.append(f"{arrow} <@{name}> #{old_position} → #{position} ({where})")
+    gone = [f"🚫 <@{name}> (was #{position}, {tier})" for name, (position, tier) in old.items() if name not in new]
+
+    embed = discord.Embed(title=f"🔀 Ranking Changes — #{from_snapshot} → #{to_snapshot}", color=0xff9900)
+    embed.description = f"{before.taken_at:%d/%m/%Y %H:%M} → {after.taken_at:%d/%m/%Y %H:%M}"
+    if moves:
+        add_field_lines(embed, "Moves", moves)
+    if gone:
+        add_field_lines(embed, "Left the ranking", gone)
+    embed.set_footer(text=f"{unchanged} player(s) kept their spot")
+    await send_embed(interaction, embed)
+
+def percent(value):
+    return "—" if value is None else f"{value:.0%}"
+
+def signed(value):
+    return "—" if value is None else f"{value:+.2f}"
+
+@tree.command(name="stats", description="Season statistics, updated after every /updateall")
+async def stats(interaction: discord.Interaction):
+    report, version = analytics_report(interaction.guild_id)
+    if version is None:
+        await interaction.response.send_message("No statistics yet. Run /updateall first!", ephemeral=True)
+        return
+    if report is None:
+        await interaction.response.send_message(
+            f"📊 Statistics for snapshot #{version} are being calculated. Try again in a moment!", ephemeral=True
+        )
+        return
+
+    embed = discord.Embed(title="📊 Season Statistics", color=0x00aaff)
+    add_field_lines(embed, "🏆 Tiers (promoted / demoted per round)", [
+        f"**{t['tier']}** — ▲ {percent(t['promotion_rate'])} ▼ {percent(t['demotion_rate'])} · "
+        f"{percent(t['winrate'])} wins · {signed(t['goal_diff_per_game'])} GD/game"
+        for t in report["tiers"] if t["players"] or t["moves"]
+    ])
+    for title, groups in (("🎮 Playstyles", report["playstyles"]), ("🪪 Licensed", report["licensed"])):
+        if groups:
+            add_field_lines(embed, title, [
+                f"**{name}** — {g['players']} player(s) · {percent(g['winrate'])} wins · "
+                f"{signed(g['goal_diff_per_game'])} GD/game"
+                for name, g in sorted(groups.items(), key=lambda item: -(item[1]["winrate"] or 0))
+            ], inline=True)
+    m = report["matches"]
+    if m["played"]:
+        embed.add_field(
+            name="⚽ Matches",
+            value=f"{m['played']} played · {m['avg_goals']} goals per match · won by {m['avg_margin']} on average",
+            inline=False
+        )
+    footer = f"Snapshot #{report['snapshot']}"
+    if report["snapshot"] != version:
+        footer += f" · #{version} is being calculated"
+    embed.set_footer(text=footer)
+    await send_embed(interaction, embed)
 
 @tree.command(name="setstats", description="Manually update a player's stats (admin only)")
 @is_admin()
@@ -873,20 +2978,20 @@ async def overview(interaction: discord.Interaction):
     licensed="Is the player licensed? Yes or No",
     playstyle="Player playstyle"
 )
-@app_commands.autocomplete(tier=tier_autocomplete, licensed=licensed_autocomplete, playstyle=playstyle_autocomplete)
-async def setstats(interaction: discord.Interaction, player: discord.Member,
+@app_commands.autocomplete(player=player_autocomplete, tier=tier_autocomplete, licensed=licensed_autocomplete,
+                           playstyle=playstyle_autocomplete)
+async def setstats(interaction: discord.Interaction, player: str,
                    wins: int = None, losses: int = None, goals: int = None,
                    tier: str = None, rank: int = None, licensed: str = None, playstyle: str = None):
-    uid = str(player.id)
-    display = player.display_name
-    p = get_player(uid)
-    if not p:
-        await interaction.response.send_message(f"❌ **{display}** not found!", ephemeral=True)
+    resolved = resolve_player(interaction, player)
+    if resolved is None:
+        await player_not_found(interaction, player)
         return
+    uid, display = resolved
 
     if tier is not None:
-        tier = tier.title()
-        if tier not in TIERS:
+        tier = resolve_tier(tier)
+        if tier is None:
             await interaction.response.send_message("❌ Invalid tier!", ephemeral=True)
             return
 
@@ -894,52 +2999,19 @@ async def setstats(interaction: discord.Interaction, player: discord.Member,
         await interaction.response.send_message("❌ Rank must be between 1 and 4!", ephemeral=True)
         return
 
-    updates = []
-    values = []
-
-    if wins is not None:
-        updates.append("wins = %s")
-        values.append(wins)
-    if losses is not None:
-        updates.append("losses = %s")
-        values.append(losses)
-    if goals is not None:
-        updates.append("goals = %s")
-        values.append(goals)
-    if tier is not None:
-        updates.append("tier = %s")
-        values.append(tier)
-    if rank is not None:
-        updates.append("rank_in_tier = %s")
-        values.append(rank)
-    if licensed is not None:
-        updates.append("licensed = %s")
-        values.append(licensed)
-    if playstyle is not None:
-        updates.append("playstyle = %s")
-        values.append(playstyle)
-
-    if not updates:
+    values = (wins, losses, goals, tier, rank, licensed, playstyle)
+    if all(v is None for v in values):
         await interaction.response.send_message("❌ You didn't change anything!", ephemeral=True)
         return
 
-    values.append(uid)
-    conn = get_db()
-    c = conn.cursor()
-    c.execute(f"UPDATE players SET {', '.join(updates)} WHERE name = %s", values)
-    conn.commit()
-
-    # If rank changed, fix conflicts in that tier
-    if rank is not None:
-        target_tier = tier if tier else p["tier"]
-        # Push any other player that has the same rank down by 1
-        c.execute(
-            "UPDATE players SET rank_in_tier = rank_in_tier + 1 WHERE tier = %s AND rank_in_tier = %s AND name != %s",
-            (target_tier, rank, uid)
-        )
-        conn.commit()
-
-    conn.close()
+    await interaction.response.defer()
+    result = write_or_journal(interaction, "setstats", uid=uid, values=values)
+    if result["status"] == "journaled":
+        await send_journaled(interaction, result)
+        return
+    if result["status"] == "missing":
+        await interaction.followup.send(f"❌ **{display}** not found!")
+        return
 
     changed = []
     if wins is not None: changed.append(f"Wins: {wins}")
@@ -950,49 +3022,54 @@ async def setstats(interaction: discord.Interaction, player: discord.Member,
     if licensed is not None: changed.append(f"Licensed: {licensed}")
     if playstyle is not None: changed.append(f"Playstyle: {playstyle}")
 
-    await interaction.response.send_message(f"✅ Updated <@{uid}>: {' | '.join(changed)}")
+    await interaction.followup.send(f"✅ Updated <@{get_uid(uid)}>: {' | '.join(changed)}")
 
 
 @tree.command(name="removeandfill", description="Remove a player and cascade ranks down through all tiers (admin only)")
 @is_admin()
 @app_commands.describe(player="Select the player to remove")
-async def removeandfill(interaction: discord.Interaction, player: discord.Member):
+@app_commands.autocomplete(player=player_autocomplete)
+async def removeandfill(interaction: discord.Interaction, player: str):
     await interaction.response.defer()
 
-    uid = str(player.id)
-    display = player.display_name
+    resolved = resolve_player(interaction, player)
+    if resolved is None:
+        await player_not_found(interaction, player)
+        return
+    uid, display = resolved
     p = get_player(uid)
     if not p:
         await interaction.followup.send(f"❌ **{display}** not found!")
         return
 
-    removed_tier = p["tier"]
-    removed_rank = p["rank_in_tier"]
+    removed_tier = p.tier
+    removed_rank = p.rank_in_tier
 
     conn = get_db()
     c = conn.cursor()
 
     # Remove the player
-    c.execute("DELETE FROM players WHERE name = %s", (uid,))
-    conn.commit()
+    run(c, "delete_player", interaction.guild_id, uid)
+    commit_change(conn, c, [removed_tier])
     conn.close()
 
     log = [f"🗑️ **{display}** removed from **{removed_tier}** (Rank {removed_rank})"]
 
     # Cascade: for each tier starting from removed_tier going down
+    tiers = guild_tiers()
     current_tier_idx = tier_index(removed_tier)
 
-    while current_tier_idx < len(TIERS) - 1:
-        current_tier = TIERS[current_tier_idx]
-        next_tier = TIERS[current_tier_idx + 1]
+    while current_tier_idx < len(tiers) - 1:
+        current_tier = tiers[current_tier_idx]
+        next_tier = tiers[current_tier_idx + 1]
 
         # Re-rank current tier (fill gaps)
         players_in_current = get_tier_players(current_tier)
         conn = get_db()
         c = conn.cursor()
         for i, p in enumerate(players_in_current):
-            c.execute("UPDATE players SET rank_in_tier = %s WHERE name = %s", (i + 1, p["name"]))
-        conn.commit()
+            run(c, "set_rank", interaction.guild_id, i + 1, p.name)
+        commit_change(conn, c, [current_tier])
         conn.close()
 
         # Check if current tier now has less than 4 players
@@ -1011,55 +3088,293 @@ async def removeandfill(interaction: discord.Interaction, player: discord.Member
 
         conn = get_db()
         c = conn.cursor()
-        c.execute(
-            "UPDATE players SET tier = %s, rank_in_tier = %s, round_wins = 0, round_losses = 0, round_done = 0 WHERE name = %s",
-            (current_tier, new_rank, promoted["name"])
-        )
-        conn.commit()
+        run(c, "fill_spot", interaction.guild_id, current_tier, new_rank, promoted.name)
+        commit_change(conn, c, [current_tier, next_tier])
         conn.close()
 
-        log.append(f"⬆️ <@{promoted['name']}> moved from **{next_tier}** rank 1 → **{current_tier}** rank {new_rank}")
+        log.append(f"⬆️ <@{promoted.name}> moved from **{next_tier}** rank 1 → **{current_tier}** rank {new_rank}")
 
         # Re-rank next tier
         players_in_next = get_tier_players(next_tier)
         conn = get_db()
         c = conn.cursor()
         for i, p in enumerate(players_in_next):
-            c.execute("UPDATE players SET rank_in_tier = %s WHERE name = %s", (i + 1, p["name"]))
-        conn.commit()
+            run(c, "set_rank", interaction.guild_id, i + 1, p.name)
+        commit_change(conn, c, [next_tier])
         conn.close()
 
         current_tier_idx += 1
 
     # Final re-rank of last tier
-    last_tier = TIERS[-1]
+    last_tier = tiers[-1]
     players_last = get_tier_players(last_tier)
     conn = get_db()
     c = conn.cursor()
     for i, p in enumerate(players_last):
-        c.execute("UPDATE players SET rank_in_tier = %s WHERE name = %s", (i + 1, p["name"]))
-    conn.commit()
+        run(c, "set_rank", interaction.guild_id, i + 1, p.name)
+    commit_change(conn, c, [last_tier])
     conn.close()
 
-    log.append(f"\n✅ A spot is now open in **{TIERS[-1]}**. Use `/addplayer` to fill it!")
+    log.append(f"\n✅ A spot is now open in **{tiers[-1]}**. Use `/addplayer` to fill it!")
 
     embed = discord.Embed(title="🔄 Player Removed — Ranks Cascaded", color=0xff4444)
     embed.description = "\n".join(log)
     await interaction.followup.send(embed=embed)
 
+def split_list(text: str):
+    return [part.strip() for part in text.split(",") if part.strip()]
+
+@tree.command(name="config", description="View or change this server's league settings (Manage Server)")
+@app_commands.default_permissions(manage_guild=True)
+@can_manage_guild()
+@app_commands.describe(
+    tiers="Tier ladder from highest to lowest, comma separated",
+    admin_roles="Roles allowed to use admin commands, comma separated",
+    announcement_channel="Channel for tier update announcements"
+)
+async def config(interaction: discord.Interaction, tiers: str = None, admin_roles: str = None,
+                 announcement_channel: discord.TextChannel = None):
+    current = guild_config()
+    new_tiers = current["tiers"] if tiers is None else split_list(tiers)
+    new_roles = current["admin_roles"] if admin_roles is None else split_list(admin_roles)
+    channel_id = current["announcement_channel_id"] if announcement_channel is None else announcement_channel.id
+
+    if not new_tiers:
+        await interaction.response.send_message("❌ The ladder needs at least one tier!", ephemeral=True)
+        return
+    if len({t.lower() for t in new_tiers}) != len(new_tiers):
+        await interaction.response.send_message("❌ Tier names must be unique!", ephemeral=True)
+        return
+    if not new_roles:
+        await interaction.response.send_message("❌ At least one admin role is needed!", ephemeral=True)
+        return
+
+    if tiers is not None or admin_roles is not None or announcement_channel is not None:
+        conn = get_db()
+        c = conn.cursor()
+        if tiers is not None:
+            # Players would disappear from every view if their tier left the ladder
+            run(c, "tier_counts", interaction.guild_id)
+            stranded = [f"**{t}** ({count})" for t, count in c.fetchall() if t not in new_tiers]
+            if stranded:
+                conn.close()
+                await interaction.response.send_message(
+                    f"❌ These tiers still have players: {', '.join(stranded)}. Move or remove them first!",
+                    ephemeral=True
+                )
+                return
+        run(c, "set_guild_config", interaction.guild_id, new_tiers, new_roles, channel_id)
+        commit_change(conn, c, ["*"])
+        conn.close()
+
+    embed = discord.Embed(title="⚙️ League Settings", color=0x00aaff)
+    add_field_lines(embed, "🏆 Tiers", [f"{i}. {t}" for i, t in enumerate(new_tiers, 1)])
+    embed.add_field(name="🛡️ Admin roles", value=", ".join(new_roles), inline=False)
+    embed.add_field(name="📢 Announcements", value=f"<#{channel_id}>" if channel_id else "Off", inline=False)
+    await send_embed(interaction, embed, ephemeral=True)
+
+def describe_row(table: str, key: str) -> str:
+    return f"<@{key}>" if table == "players" else f"match #{key}"
+
+def describe_change(before, after) -> str:
+    """One line per audited row: what was created, removed or changed."""
+    if before is None:
+        return "created"
+    if after is None:
+        return "removed"
+    fields = [f"{k}: {before.get(k)} → {after[k]}" for k in after if k != "guild_id" and before.get(k) != after[k]]
+    return ", ".join(fields) or "unchanged"
+
+@tree.command(name="auditlog", description="Show who changed league data, or the details of one change (admin only)")
+@is_admin()
+@app_commands.describe(
+    player="Only show changes to this player",
+    entry="Entry number to show in full"
+)
+@app_commands.autocomplete(player=player_autocomplete)
+async def auditlog(interaction: discord.Interaction, player: str = None, entry: int = None):
+    uid = None
+    if player is not None:
+        resolved = resolve_player(interaction, player)
+        if resolved is None:
+            await player_not_found(interaction, player)
+            return
+        uid = resolved[0]
+
+    conn = get_db()
+    c = conn.cursor()
+    if entry is None:
+        run(c, "audit_actions", interaction.guild_id, uid, AUDIT_LOG_LIMIT)
+    else:
+        run(c, "audit_entry", interaction.guild_id, entry)
+    rows = c.fetchall()
+    conn.close()
+
+    if not rows:
+        what = f"Entry #{entry} not found!" if entry is not None else "No audited changes yet!"
+        await interaction.response.send_message(f"❌ {what}", ephemeral=True)
+        return
+
+    if entry is None:
+        lines = []
+        for first, actor, command, at, count, players in rows:
+            who = ", ".join(f"<@{p}>" for p in players or [])
+            lines.append(f"`#{first}` {at:%d/%m %H:%M} <@{actor}> /{command} — {count} row(s) {who}")
+        embed = discord.Embed(title="📜 Audit Log", color=0x888888)
+        add_field_lines(embed, "Latest changes", lines)
+        embed.set_footer(text="Use /auditlog entry:<number> for details, /auditrevert to undo")
+    else:
+        _, _, _, _, actor, command, at = rows[0]
+        embed = discord.Embed(title=f"📜 Audit Entry #{entry} — /{command}", color=0x888888)
+        embed.description = f"By <@{actor}> on {at:%d/%m/%Y %H:%M}"
+        add_field_lines(embed, "Changes", [
+            f"{describe_row(table, key)}: {describe_change(before, after)}"
+            for table, key, before, after, *_ in rows
+        ])
+    await send_embed(interaction, embed, ephemeral=True, allowed_mentions=discord.AllowedMentions.none())
+
+@tree.command(name="auditrevert", description="Undo an audited change (admin only)")
+@is_admin()
+@app_commands.describe(entry="Entry number from /auditlog")
+async def auditrevert(interaction: discord.Interaction, entry: int):
+    conn = get_db()
+    c = conn.cursor()
+    run(c, "revert", interaction.guild_id, entry)
+    result = c.fetchone()[0]
+    if result["status"] != "ok":
+        conn.rollback()
+        conn.close()
+        if result["status"] == "missing":
+            message = f"❌ Entry #{entry} not found!"
+        else:
+            row = describe_row(result["table"], result["row"])
+            change = describe_change(result["expected"], result["current"])
+            if result["later"] is not None:
+                message = (f"❌ {row} changed again after entry #{entry} ({change}). "
+                           f"Revert entry #{result['later']} first!")
+            else:
+                # e.g. /score, which isn't audited
+                message = (f"❌ {row} was changed outside the audit log after entry #{entry} ({change}), "
+                           "so it can't be restored automatically.")
+        await interaction.response.send_message(message, ephemeral=True, allowed_mentions=discord.AllowedMentions.none())
+        return
+    commit_change(conn, c, result["tiers"] or ["*"])
+    conn.close()
+    await interaction.response.send_message(f"↩️ Reverted entry #{entry} ({result['rows']} row(s) restored)")
+
+async def command_autocomplete(interaction: discord.Interaction, current: str):
+    names = ["*"] + sorted(cmd.name for cmd in tree.get_commands())
+    return [
+        app_commands.Choice(name="* (any command)" if n == "*" else f"/{n}", value=n)
+        for n in names if current.lower().lstrip("/") in n.lower()
+    ][:25]
+
+@tree.command(name="profiler", description="Profile the next run(s) of a command (admin only)")
+@is_admin()
+@app_commands.describe(
+    command="Command to profile, or * for whichever runs next",
+    runs="How many runs to profile (1-20, default 1)"
+)
+@app_commands.autocomplete(command=command_autocomplete)
+async def profiler(interaction: discord.Interaction, command: str, runs: int = 1):
+    command = command.strip().lstrip("/")
+    if command != "*" and tree.get_command(command) is None:
+        await interaction.response.send_message(f"❌ Unknown command `/{command}`!", ephemeral=True)
+        return
+    if runs < 1 or runs > 20:
+        await interaction.response.send_message("❌ Runs must be between 1 and 20!", ephemeral=True)
+        return
+
+    _profile_armed[command] = (runs, interaction)
+    target = "any command" if command == "*" else f"`/{command}`"
+    await interaction.response.send_message(
+        f"🔬 Profiling the next {runs} run(s) of {target}. Summaries will show up here.", ephemeral=True
+    )
+
 # ─────────────────────────────────────────
 # BOT EVENTS
 # ─────────────────────────────────────────
+_process_started = time.perf_counter()
+_startup_done = False
+
+def command_tree_hash(guild=None) -> str:
+    """Stable hash of the command tree as Discord would see it.
+
+    Covers names, descriptions, options (incl. autocomplete and choices)
+    and permissions via to_dict(), plus the names of the local checks."""
+    payload = []
+    for cmd in sorted(tree.get_commands(guild=guild), key=lambda c: c.name):
+        data = cmd.to_dict(tree)
+        data["checks"] = sorted(f"{chk.__module__}.{chk.__qualname__}" for chk in getattr(cmd, "checks", []))
+        payload.append(data)
+    raw = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+async def sync_commands():
+    """Sync the command tree only if it changed since the last sync."""
+    guild = discord.Object(id=DEV_GUILD_ID) if DEV_GUILD_ID else None
+    if guild:
+        tree.copy_global_to(guild=guild)
+    key = f"command_hash:{DEV_GUILD_ID or 'global'}"
+    current = command_tree_hash(guild)
+    if get_state(key) == current and not os.environ.get("FORCE_COMMAND_SYNC"):
+        print("🎮 Slash commands unchanged, skipping sync")
+        return
+    synced = await tree.sync(guild=guild)
+    set_state(key, current)
+    print(f"🎮 Slash commands synced: {len(synced)} commands" + (f" to guild {DEV_GUILD_ID}" if guild else ""))
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    finish_trace(interaction, ok=True)
+    await finish_profile(interaction)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.display_name != after.display_name:
+        bump_names(after.guild.id)
+
+@bot.event
+async def on_user_update(before: discord.User, after: discord.User):
+    if before.display_name != after.display_name:
+        # Only the guilds that show this user's name
+        for guild in after.mutual_guilds:
+            bump_names(guild.id)
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    bump_names(member.guild.id)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    bump_names(member.guild.id)
+
 @bot.event
 async def on_ready():
+    global _startup_done
+    # The member cache may have been (re)filled, so rendered names could be stale
+    bump_names()
+    if _startup_done:
+        # Reconnects fire on_ready again; everything below already happened
+        print(f"🔌 Reconnected as {bot.user}")
+        return
     try:
         print(f"⏳ on_ready started for {bot.user}")
+        timings = [("login", time.perf_counter() - _process_started)]
+        t = time.perf_counter()
+        start_journal_drainer()
         setup_db()
+        start_cache_listener()
+        timings.append(("database", time.perf_counter() - t))
         print("📊 Database ready")
         print("👥 Skipping member cache preload")
-        synced = await tree.sync()
+        t = time.perf_counter()
+        await sync_commands()
+        timings.append(("command sync", time.perf_counter() - t))
+        _startup_done = True
         print(f"✅ Bot is online as {bot.user}!")
-        print(f"🎮 Slash commands synced: {len(synced)} commands")
+        timings.append(("total", time.perf_counter() - _process_started))
+        print("⏱️ Startup: " + " | ".join(f"{name} {secs * 1000:.0f}ms" for name, secs in timings))
     except Exception as e:
         print(f"❌ on_ready error: {e}")
 
@@ -1072,8 +3387,20 @@ app = Flask(__name__)
 def home():
     return "Bot is running!"
 
+@app.route("/metrics")
+def metrics():
+    return {"outbox": outbox_metrics(), "queries": query_metrics(), "journal": journal_metrics()}
+
+@app.route("/stats/<int:guild_id>")
+def web_stats(guild_id):
+    report, version = analytics_report(guild_id)
+    if report is None:
+        return {"status": "pending" if version is not None else "no snapshots", "snapshot": version}, 202
+    return {**report, "latest_snapshot": version}
+
 def run_web():
     app.run(host="0.0.0.0", port=8080)
 
-Thread(target=run_web).start()
-bot.run(BOT_TOKEN)
+if __name__ == "__main__":
+    Thread(target=run_web).start()
+    bot.run(BOT_TOKEN)
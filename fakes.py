@@ -0,0 +1,112 @@
+"""Stand-ins for the discord.py objects a slash command touches.
+
+Used by bench.py and replay.py to drive the real command callbacks in bot.py
+without a gateway connection. Only the attributes the commands actually use
+are implemented.
+"""
+import time
+from datetime import datetime, timezone
+from itertools import count
+
+import discord
+
+_ids = count(1)
+
+
+class FakeRole:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeMember:
+    def __init__(self, id, display_name=None, roles=()):
+        self.id = int(id)
+        self.name = display_name or f"player{id}"
+        self.display_name = display_name or f"player{id}"
+        self.roles = [FakeRole(r) for r in roles]
+        self.display_avatar = FakeAsset()
+        self.mention = f"<@{self.id}>"
+        self.bot = False
+
+
+class FakeGuild:
+    def __init__(self, id=1, members=()):
+        self.id = id
+        self.name = "CFI"
+        self._members = {m.id: m for m in members}
+
+    def add_member(self, member):
+        self._members[member.id] = member
+        return member
+
+    def get_member(self, user_id):
+        return self._members.get(int(user_id))
+
+    async def fetch_member(self, user_id):
+        return self._members.get(int(user_id))
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    def _ack(self):
+        if not self._done:
+            self._done = True
+            self._interaction.acknowledged_at = time.perf_counter()
+
+    async def defer(self, *, ephemeral=False, thinking=False):
+        self._ack()
+
+    async def send_message(self, content=None, *, embed=None, ephemeral=False, **kwargs):
+        self._ack()
+        self._interaction.sent.append({"content": content, "embed": embed, "ephemeral": ephemeral})
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, *, embed=None, ephemeral=False, **kwargs):
+        self._interaction.sent.append({"content": content, "embed": embed, "ephemeral": ephemeral})
+
+
+class FakeNamespace:
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+    def __getattr__(self, name):
+        return None
+
+    def __iter__(self):
+        return iter(self.__dict__.items())
+
+
+class FakeInteraction:
+    """An application command interaction for `command` invoked by `user` in `guild`."""
+
+    def __init__(self, guild, user, command=None, channel_id=1, options=None, permissions=None,
+                 type=discord.InteractionType.application_command):
+        self.id = next(_ids)
+        self.type = type
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel_id = channel_id
+        self.user = user
+        self.permissions = permissions or discord.Permissions.none()
+        self.command = command
+        self.namespace = FakeNamespace(**(options or {}))
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at = time.perf_counter()
+        self.acknowledged_at = None
+        self.sent = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
@@ -0,0 +1,224 @@
+"""Replay recorded round-night traffic against the bot's handlers.
+
+Traces come from the opt-in recorder in bot.py (set TRACE_FILE) or from the
+synthetic season generator below. Commands are dispatched through a fake
+gateway at their recorded arrival times, sped up by --speed, each in its own
+task like the real CommandTree does. The report covers throughput, latency,
+event-loop lag and interactions that were not acknowledged within Discord's
+3 second deadline.
+
+    BENCH_DATABASE_URL=postgresql://localhost/cfi_bench python replay.py play night.jsonl --speed 10
+    python replay.py season --rounds 3 --trace season.jsonl
+
+Like bench.py this reseeds BENCH_DATABASE_URL, so use a throwaway database.
+Pseudonymous players in a trace are mapped onto the seeded league, so the
+replay reproduces the load, not the original results.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import discord
+
+import bench
+from fakes import FakeGuild, FakeInteraction, FakeMember
+
+ACK_DEADLINE = 3.0            # seconds Discord allows before an interaction must be acknowledged
+LAG_SAMPLE_INTERVAL = 0.01
+SEASON_COMMAND_GAP = 15.0     # simulated seconds between commands in a generated season
+
+
+class Gateway:
+    """Dispatches command invocations to the bot like discord.py would."""
+
+    def __init__(self, bot, players: int = 60):
+        self.bot = bot
+        self.players = [FakeMember(100000 + i) for i in range(1, players + 1)]
+        self.guild = FakeGuild(bench.BENCH_GUILD_ID, members=self.players)
+        self.admin = self.guild.add_member(FakeMember(1, "replay-admin", roles=bot.ADMIN_ROLES[:1]))
+        self.aliases = {}  # trace pseudonym -> seeded player
+        self.finished = []  # (latency, time to acknowledge or None, ok)
+
+    def resolve(self, command, option, value):
+        """Turn a recorded {"member": pseudonym} back into a member of the seeded league.
+
+        User options get the member, player options (autocompleted strings) their id."""
+        if isinstance(value, dict) and "member" in value:
+            alias = value["member"]
+            if alias not in self.aliases:
+                self.aliases[alias] = self.players[len(self.aliases) % len(self.players)]
+            member = self.aliases[alias]
+            param = command._params.get(option)
+            if param is not None and param.type is discord.AppCommandOptionType.user:
+                return member
+            return str(member.id)
+        return value
+
+    async def invoke(self, name, **options):
+        command = self.bot.tree.get_command(name)
+        interaction = FakeInteraction(self.guild, self.admin, command=command, options=options)
+        ok = True
+        try:
+            await self.bot.tree.interaction_check(interaction)
+            await command.callback(interaction, **options)
+        except Exception as e:
+            ok = False
+            print(f"  /{name} failed: {e}")
+        acked = interaction.acknowledged_at - interaction.started_at if interaction.acknowledged_at else None
+        self.finished.append((time.perf_counter() - interaction.started_at, acked, ok))
+        return interaction
+
+
+async def watch_loop(lags, stop):
+    """Sample how late the event loop wakes us up; blocking handlers show up here."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        before = loop.time()
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+        lags.append(max(0.0, loop.time() - before - LAG_SAMPLE_INTERVAL))
+
+
+def load_trace(path):
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+async def play(gateway, events, speed):
+    lags = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(lags, stop))
+    started = time.perf_counter()
+    first = events[0]["t"] if events else 0
+    tasks = []
+    for event in events:
+        delay = (event["t"] - first) / speed - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        command = gateway.bot.tree.get_command(event["command"])
+        options = {k: gateway.resolve(command, k, v) for k, v in event.get("options", {}).items()}
+        tasks.append(asyncio.create_task(gateway.invoke(event["command"], **options)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await watcher
+    return elapsed, lags
+
+
+async def season(gateway, rounds, rng, trace=None):
+    """Play full rounds: score every valid matchup in every tier, then updatetier and updateall.
+
+    With a trace file, the generated commands are written in the recorder's
+    format with simulated arrival times, so they replay at round-night pace."""
+    bot = gateway.bot
+    lags = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(lags, stop))
+    clock = time.time()
+    started = time.perf_counter()
+
+    async def command(name, **options):
+        nonlocal clock
+        clock += SEASON_COMMAND_GAP
+        interaction = await gateway.invoke(name, **options)
+        # Commands run back to back here; let the lag watcher get a look in
+        await asyncio.sleep(0)
+        if trace:
+            latency, _, ok = gateway.finished[-1]
+            trace.write(json.dumps({
+                "t": round(clock, 3),
+                "command": name,
+                "user": bot.pseudonym(gateway.admin.id),
+                "options": {k: bot.anonymize(v, k in bot.PLAYER_OPTIONS) for k, v in options.items()},
+                "ms": round(latency * 1000, 1),
+                "ok": ok,
+            }, separators=(",", ":")) + "\n")
+        return interaction
+
+    for round_no in range(1, rounds + 1):
+        print(f"Round {round_no}", flush=True)
+        for tier in bot.TIERS:
+            previous = None
+            while True:
+                matchups = bot.get_valid_matchups(tier)
+                if not matchups:
+                    break
+                if matchups == previous:
+                    # Nothing from the last pass was applied (failed or journaled scores)
+                    print(f"  {tier}: {len(matchups)} matchup(s) could not be scored, moving on")
+                    break
+                previous = matchups
+                for a, b, _ in matchups:
+                    goals1, goals2 = rng.sample(range(0, 7), 2)
+                    await command("score", player1=a, goals1=goals1, player2=b, goals2=goals2)
+                await command("bracket", tier=tier)
+            await command("overview")
+        for tier in bot.TIERS:
+            await command("updatetier", tier=tier)
+        await command("updateall")
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await watcher
+    return elapsed, lags
+
+
+def report(gateway, elapsed, lags):
+    done = gateway.finished
+    latencies = [d[0] for d in done]
+    acks = [d[1] for d in done]
+    misses = sum(1 for a in acks if a is None or a > ACK_DEADLINE)
+    failures = sum(1 for d in done if not d[2])
+    assert lags, "the event loop lag watcher never ran"
+    print(f"\n{len(done)} interactions in {elapsed:.1f}s ({len(done) / elapsed if elapsed else 0:.1f}/s)")
+    if latencies:
+        print(f"latency        p50 {bench.percentile(latencies, 0.5) * 1000:8.1f} ms   "
+              f"p99 {bench.percentile(latencies, 0.99) * 1000:8.1f} ms")
+    if lags:
+        print(f"event loop lag p50 {bench.percentile(lags, 0.5) * 1000:8.1f} ms   "
+              f"p99 {bench.percentile(lags, 0.99) * 1000:8.1f} ms   max {max(lags) * 1000:.1f} ms")
+    print(f"deadline misses {misses} (not acknowledged within {ACK_DEADLINE:.0f}s), failures {failures}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="mode", required=True)
+    p = sub.add_parser("play", help="replay a recorded trace")
+    p.add_argument("trace")
+    p.add_argument("--speed", type=float, default=1.0, help="1, 10, 100… times the recorded pace")
+    p.add_argument("--players", type=int, default=60)
+    s = sub.add_parser("season", help="generate and run full seasons through score → updatetier → updateall")
+    s.add_argument("--rounds", type=int, default=3)
+    s.add_argument("--seed", type=int, default=0)
+    s.add_argument("--trace", help="also write the generated commands as a trace file")
+    args = parser.parse_args()
+
+    bench.configure_database()
+    import bot
+    bot.setup_db()
+    # Seeding and get_valid_matchups() outside interactions act on the bench guild
+    bot._current_guild.set(bench.BENCH_GUILD_ID)
+    bot.start_cache_listener()
+    while not bot._cache_listening:
+        time.sleep(0.05)
+
+    players = args.players if args.mode == "play" else 60
+    bench.seed_league(bot, players, bench.LEAGUE_SIZES.get(players, players * 100))
+    gateway = Gateway(bot, players)
+    # Never append replayed traffic to the live recorder's file
+    bot.TRACE_FILE = None
+
+    if args.mode == "play":
+        elapsed, lags = asyncio.run(play(gateway, load_trace(args.trace), args.speed))
+    elif args.trace:
+        with open(args.trace, "w") as trace:
+            elapsed, lags = asyncio.run(season(gateway, args.rounds, random.Random(args.seed), trace))
+    else:
+        elapsed, lags = asyncio.run(season(gateway, args.rounds, random.Random(args.seed)))
+    report(gateway, elapsed, lags)
+
+
+if __name__ == "__main__":
+    main()